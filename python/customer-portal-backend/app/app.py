@@ -35,6 +35,14 @@ from chalicelib.routes.cooldown import bp_cooldown
 from chalicelib.routes.reporting import bp_reporting
 from chalicelib.routes.user_redux import bp_users_redux
 from chalicelib.utils import logger, metrics, tracer
+from chalicelib.codec import HTTP_CONTENT_ENCODING
+from chalicelib.services.AlertQueue import coalesced_alerts
+from chalicelib.instrumentation import (
+    instrument_request,
+    log_repeated_queries,
+    publish_request_metrics,
+    response_size,
+)
 
 region = os.environ.get("REGION", "UnknownRegion")
 stage = os.environ.get("EMAIL_SRC", "Unknown")
@@ -71,6 +79,9 @@ cors_config = CORSConfig(
     allow_origin=os.environ.get("ALLOWED_ORIGIN"), allow_credentials=True
 )
 app.api.cors = cors_config
+if HTTP_CONTENT_ENCODING:
+    # brotli/gzip encoded JSON bodies must reach API Gateway as binary
+    app.api.binary_types.append("application/json")
 
 
 @app.middleware("all")
@@ -84,6 +95,13 @@ def initialize_user_session(event, get_response):
     return response
 
 
+@app.middleware("all")
+def deliver_alerts(event, get_response):
+    # Alerts sent while handling the event go out as digests before the invocation ends
+    with coalesced_alerts():
+        return get_response(event)
+
+
 @app.middleware("http")
 def initialize_sentry(event, get_response):
     logger.structure_logs(append=True, request_path=event.path)
@@ -91,7 +109,10 @@ def initialize_sentry(event, get_response):
 
     with sentry_sdk.start_transaction(
         op="CustomerWebApp HTTP Request", name=f"{event.method}: {event.path}"
-    ):
+    ), instrument_request(
+        f"{event.method} {event.path}",
+        track_queries=stage != "PROD" and "x-query-tracking" in event.headers,
+    ) as stats:
         set_tag(key="cw_path", value=event.path)
         response = None
         try:
@@ -110,6 +131,15 @@ def initialize_sentry(event, get_response):
                 else:
                     response.body = traceback.format_exc()
         finally:
+            # Failed requests are reported too
+            try:
+                if response is not None:
+                    stats.response_bytes = response_size(response.body, stats)
+                logger.info("Request stats", **stats.as_dict())
+                publish_request_metrics(metrics, stats)
+                log_repeated_queries(stats)
+            except Exception as me:
+                logger.error("Error publishing request stats", error=me)
             return response
 
 
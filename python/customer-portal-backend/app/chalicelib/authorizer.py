@@ -6,6 +6,7 @@ from backendlib.secretsmanager import get_jwt_secret
 import jwt
 import base64
 from datetime import timedelta
+from functools import lru_cache
 from backendlib.sessionmanager import initialize as initialize_session
 import logging
 
@@ -44,6 +45,15 @@ class AuthorizedUser(object):
         self.admin_pw_flag = get_admin_pw_flag(request)
 
 
+@lru_cache(maxsize=256)
+def _api_routes(read_permissions):
+    """AuthRoutes for a frozenset of granted read_ permission names"""
+    return [
+        AuthRoute(path=f"/api/{k.split('read_')[1]}", methods=["GET"])
+        for k in sorted(read_permissions)
+    ]
+
+
 @bp_authorizer.authorizer(ttl_seconds=5)
 def auth_api(auth_request):
     """Generate an AWS AuthResponse Object based on the API request
@@ -64,10 +74,8 @@ def auth_api(auth_request):
         return AuthResponse(routes=["/"], principal_id="unauthenticated")
 
     return AuthResponse(
-        routes=[
-            AuthRoute(path=f"/api/{k.split('read_')[1]}", methods=["GET"])
-            for k, v in permissions.items()
-            if k.startswith("read") and v
-        ],
+        routes=_api_routes(
+            frozenset(k for k, v in permissions.items() if k.startswith("read") and v)
+        ),
         context=dict(user_id=user_id, **permissions),
     )
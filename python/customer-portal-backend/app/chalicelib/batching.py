@@ -0,0 +1,11 @@
+from itertools import islice
+
+
+def batched(iterable, size):
+    """Yield lists of at most size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
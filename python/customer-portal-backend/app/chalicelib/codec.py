@@ -0,0 +1,111 @@
+"""Response encoding for the portal routes
+
+json_zip and b64zip produce the same base64 zlib payload the frontend already
+decodes, using orjson when it is installed (stdlib json otherwise) and a tunable zlib
+level. Datetimes keep the str() text json.dumps(default=str) wrote, orjson passes
+them through to the same default. encode_http_body compresses raw JSON responses
+with brotli or gzip for clients that send a matching Accept-Encoding, when
+HTTP_CONTENT_ENCODING is on. That needs application/json registered as a binary
+type so API Gateway passes the bytes through, app.py does so when the flag is set.
+"""
+
+import base64
+import datetime
+import gzip
+import json
+import os
+import zlib
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# "orjson" or "json", orjson falls back to json when it is not installed
+RESPONSE_CODEC = os.environ.get("RESPONSE_CODEC", "orjson")
+# 1 is fastest, 9 smallest, zlib's own default is 6
+RESPONSE_ZLIB_LEVEL = int(os.environ.get("RESPONSE_ZLIB_LEVEL", 6))
+HTTP_CONTENT_ENCODING = os.environ.get("HTTP_CONTENT_ENCODING", "").lower() in (
+    "1",
+    "true",
+)
+# Raw responses smaller than this are not worth a Content-Encoding
+HTTP_ENCODING_MIN_BYTES = int(os.environ.get("HTTP_ENCODING_MIN_BYTES", 1024))
+
+
+def _default(obj):
+    # Same text json.dumps(default=str) produced, e.g. "2024-01-31 10:00:00+00:00"
+    if isinstance(obj, (datetime.date, datetime.time, Decimal)):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(
+        obj,
+        default=_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+    )
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+dumps = (
+    _orjson_dumps if orjson is not None and RESPONSE_CODEC == "orjson" else _json_dumps
+)
+
+
+def b64zip(payload, level=RESPONSE_ZLIB_LEVEL):
+    """base64 encoded zlib of a str or bytes payload"""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    return base64.b64encode(zlib.compress(payload, level)).decode("utf-8")
+
+
+def json_zip(obj, level=RESPONSE_ZLIB_LEVEL):
+    """JSON encode obj then b64zip it, drop in for backendlib.utils.json_zip"""
+    return b64zip(dumps(obj), level)
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the best supported Content-Encoding from an Accept-Encoding header
+
+    Returns:
+        str: "br", "gzip" or None
+    """
+    offered = {
+        part.split(";")[0].strip().lower()
+        for part in (accept_encoding or "").split(",")
+        if not part.strip().endswith(";q=0")
+    }
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def encode_http_body(obj, accept_encoding):
+    """JSON encode obj and compress it for the client when worth it
+
+    Returns:
+        tuple: (body, content_encoding) body is bytes when content_encoding is set,
+            otherwise the JSON text
+    """
+    data = dumps(obj)
+    encoding = negotiate_encoding(accept_encoding) if HTTP_CONTENT_ENCODING else None
+    if encoding is None or len(data) < HTTP_ENCODING_MIN_BYTES:
+        return data.decode("utf-8"), None
+    if encoding == "br":
+        return brotli.compress(data, quality=5), encoding
+    return gzip.compress(data, compresslevel=RESPONSE_ZLIB_LEVEL), encoding
@@ -0,0 +1,269 @@
+"""Per request instrumentation for the portal routes
+
+A RequestStats object is bound to the current request by the http middleware in
+app.py. SQLAlchemy engine events add every query's count, time and row count to it,
+and the json_zip / camelize wrappers below add serialization time. When the request
+finishes the totals are exported as powertools metrics with a route dimension.
+
+With query tracking on, each query is also fingerprinted so statements repeated
+within a request (N+1 patterns) are logged, and query_budget can enforce a maximum
+number of queries for a block or route handler.
+"""
+
+import os
+import re
+import time
+from collections import Counter
+from contextlib import ContextDecorator, contextmanager
+from contextvars import ContextVar
+
+from aws_lambda_powertools.metrics import MetricUnit, single_metric
+from backendlib.helpers.casing_converter import camelize as _camelize
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from chalicelib.codec import json_zip as _json_zip
+from chalicelib.utils import logger
+
+# Fingerprint every query of every request, otherwise only when asked per request
+QUERY_TRACKING = os.environ.get("QUERY_TRACKING", "").lower() in ("1", "true")
+# Raise QueryBudgetExceeded instead of logging, set by the test suite
+QUERY_BUDGET_STRICT = os.environ.get("QUERY_BUDGET_STRICT", "").lower() in ("1", "true")
+# A fingerprint run this many times in one request is reported as a repeated query
+REPEATED_QUERY_THRESHOLD = int(os.environ.get("REPEATED_QUERY_THRESHOLD", 3))
+
+_current_stats = ContextVar("request_stats", default=None)
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAM_LISTS = re.compile(r"\((?:\s*(?:%\([^)]+\)s|\?|%s|:\w+)\s*,?)+\)")
+_SPACES = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def fingerprint(statement):
+    """Normalize a SQL statement so the same query with other values compares equal"""
+    statement = _LITERALS.sub("?", statement)
+    statement = _PARAM_LISTS.sub("(...)", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+class RequestStats(object):
+    def __init__(self, route, track_queries=False):
+        self.route = route
+        self.track_queries = track_queries
+        self.fingerprints = Counter()
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.serialization_seconds = 0.0
+        self.serializing = False
+        # Size of the payloads json_zip encoded, dict bodies are measured by it
+        self.encoded_bytes = 0
+        self.response_bytes = 0
+        self.started_at = time.perf_counter()
+
+    @property
+    def duration_seconds(self):
+        return time.perf_counter() - self.started_at
+
+    def as_dict(self):
+        return dict(
+            route=self.route,
+            duration_ms=round(self.duration_seconds * 1000, 2),
+            query_count=self.query_count,
+            db_ms=round(self.db_seconds * 1000, 2),
+            rows=self.rows,
+            serialization_ms=round(self.serialization_seconds * 1000, 2),
+            response_bytes=self.response_bytes,
+        )
+
+    def repeated_queries(self, threshold=REPEATED_QUERY_THRESHOLD):
+        """Fingerprints run at least threshold times, most repeated first"""
+        return [(fp, n) for fp, n in self.fingerprints.most_common() if n >= threshold]
+
+
+def current_stats():
+    """RequestStats of the request being handled, None outside of a request"""
+    return _current_stats.get()
+
+
+@contextmanager
+def instrument_request(route, track_queries=False):
+    """Collect RequestStats for everything run inside the block
+
+    Args:
+        track_queries (bool): fingerprint queries to find repeats, always on with QUERY_TRACKING
+    """
+    stats = RequestStats(route, track_queries=track_queries or QUERY_TRACKING)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, a statement that fails never reaches
+    # after_cursor_execute and its context is dropped with it
+    if _current_stats.get() is not None and context is not None:
+        context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    started = getattr(context, "_query_start", None)
+    if stats is None or started is None:
+        return
+    stats.db_seconds += time.perf_counter() - started
+    stats.query_count += 1
+    if stats.track_queries:
+        stats.fingerprints[fingerprint(statement)] += 1
+    # rowcount is the number of rows a SELECT returned for psycopg2, -1 when unknown
+    if cursor.rowcount and cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+
+
+@contextmanager
+def timed_serialization():
+    stats = _current_stats.get()
+    # Nested blocks, e.g. camelize inside a timed block, are only counted once
+    if stats is None or stats.serializing:
+        yield
+        return
+    stats.serializing = True
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializing = False
+        stats.serialization_seconds += time.perf_counter() - started_at
+
+
+def json_zip(*args, **kwargs):
+    """codec.json_zip, timed as serialization and counted in encoded_bytes"""
+    with timed_serialization():
+        payload = _json_zip(*args, **kwargs)
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.encoded_bytes += len(payload)
+    return payload
+
+
+def camelize(*args, **kwargs):
+    """backendlib camelize, timed as serialization"""
+    with timed_serialization():
+        return _camelize(*args, **kwargs)
+
+
+def response_size(body, stats=None):
+    """Bytes of a response body without serializing it again
+
+    Encoded str and bytes bodies are measured directly. Other bodies are only
+    serialized by Chalice after the middleware, they are reported as the json_zip
+    payloads they carry, stats.encoded_bytes.
+    """
+    if body is None:
+        return 0
+    if isinstance(body, bytes):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode())
+    return stats.encoded_bytes if stats is not None else 0
+
+
+def publish_request_metrics(metrics, stats):
+    """Export a finished request's RequestStats as metrics with a route dimension"""
+    for name, unit, value in (
+        ("request_duration", MetricUnit.Milliseconds, stats.duration_seconds * 1000),
+        ("db_query_count", MetricUnit.Count, stats.query_count),
+        ("db_duration", MetricUnit.Milliseconds, stats.db_seconds * 1000),
+        ("db_rows", MetricUnit.Count, stats.rows),
+        (
+            "serialization_duration",
+            MetricUnit.Milliseconds,
+            stats.serialization_seconds * 1000,
+        ),
+        ("response_bytes", MetricUnit.Bytes, stats.response_bytes),
+    ):
+        with single_metric(
+            name=name,
+            unit=unit,
+            value=value,
+            namespace=metrics.namespace,
+            default_dimensions=metrics.default_dimensions,
+        ) as metric:
+            metric.add_dimension(name="route", value=stats.route)
+
+
+def log_repeated_queries(stats):
+    for statement, count in stats.repeated_queries():
+        logger.warning(
+            "Repeated query", route=stats.route, count=count, statement=statement
+        )
+
+
+class query_budget(ContextDecorator):
+    """Fail or warn when a block or route handler runs more than max_queries queries
+
+    Outside of an instrumented request a request scope is started for the block.
+    With QUERY_BUDGET_STRICT set (tests) QueryBudgetExceeded is raised, otherwise a
+    warning with the repeated queries is logged.
+
+    Usage:
+        @bp.route("/path", authorizer=auth)
+        @query_budget(8)
+        def handler(): ...
+
+        with query_budget(8):
+            handler()
+    """
+
+    def __init__(self, max_queries, name=None):
+        self.max_queries = max_queries
+        self.name = name
+
+    def _recreate_cm(self):
+        # Fresh state for every decorated call, handlers may run concurrently
+        return query_budget(self.max_queries, self.name)
+
+    def __enter__(self):
+        self._scope = None
+        stats = _current_stats.get()
+        if stats is None:
+            self._scope = instrument_request(self.name or "query_budget", True)
+            stats = self._scope.__enter__()
+        # Restored on exit, tracking only stays on for the rest of the request when
+        # it already was
+        self._track_queries = stats.track_queries
+        stats.track_queries = True
+        self._stats = stats
+        self._start_count = stats.query_count
+        self._start_fingerprints = Counter(stats.fingerprints)
+        return stats
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        try:
+            used = self._stats.query_count - self._start_count
+            if exc_type is None and used > self.max_queries:
+                repeated = [
+                    (fp, n)
+                    for fp, n in (
+                        self._stats.fingerprints - self._start_fingerprints
+                    ).most_common()
+                    if n >= REPEATED_QUERY_THRESHOLD
+                ]
+                message = f"{self.name or self._stats.route} ran {used} queries, budget is {self.max_queries}"
+                if QUERY_BUDGET_STRICT:
+                    raise QueryBudgetExceeded(
+                        "\n".join([message] + [f"{n}x {fp}" for fp, n in repeated])
+                    )
+                logger.warning(message, repeated_queries=repeated)
+        finally:
+            self._stats.track_queries = self._track_queries
+            if self._scope is not None:
+                self._scope.__exit__(exc_type, exc_value, exc_tb)
+        return False
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 64))
+# Upper bound on the total size of the cached bodies, shared Lambda memory
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.environ.get("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+)
+# Upper bound on how long a cached body is served, covers data outside the version check
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", 3600))
+
+
+class ResponseCache(object):
+    """Thread safe LRU of response bodies keyed by ETag, entries expire after ttl_seconds
+
+    Least recently used entries are evicted once there are more than max_size of them
+    or their sizes add up to more than max_bytes.
+    """
+
+    def __init__(
+        self,
+        max_size=RESPONSE_CACHE_SIZE,
+        ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+        max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    ):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is None:
+                return None
+            expires_at, size, body = entry
+            if expires_at < time.monotonic():
+                self._pop(etag)
+                return None
+            self._entries.move_to_end(etag)
+            return body
+
+    def set(self, etag, body, size=0):
+        """
+        Args:
+            size (int): bytes body holds, bodies larger than max_bytes are not cached
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(etag)
+            self._entries[etag] = (time.monotonic() + self.ttl_seconds, size, body)
+            self._bytes += size
+            while len(self._entries) > self.max_size or self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def _pop(self, etag):
+        entry = self._entries.pop(etag, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+def make_etag(*parts):
+    """Strong ETag from the str() of every part"""
+    digest = hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match, etag):
+    """True when an If-None-Match header value lists etag
+
+    "*" is not honoured, the cache only answers 304 for a body the client holds.
+    """
+    if not if_none_match:
+        return False
+    candidates = {c.strip() for c in if_none_match.split(",")}
+    return etag in candidates or f"W/{etag}" in candidates
@@ -1,4 +1,4 @@
-from chalice import BadRequestError, Blueprint
+from chalice import BadRequestError, Blueprint, Response
 from backendlib.sessionmanager import get_session, render_query
 from collections import defaultdict
 from chalicelib.authorizer import auth_api, auth
@@ -11,7 +11,8 @@ from chalicelib.services.ApiService import (
     update_api_access,
 )
 from backendlib.helpers.defaulter_dict import DefaultingDictList
-from sqlalchemy.sql import func, and_, case
+from sqlalchemy.sql import func, and_, case, cast, distinct, values, column
+from sqlalchemy.types import String, Text
 
 from backendlib.models import (
     DeviceStatusMostRecent,
@@ -38,17 +39,38 @@ from backendlib.models import (
     TriggeredAction,
     VendorLocationMapping,
 )
-from backendlib.utils import json_zip
-from chalicelib.services.GoalService import get_open_close_dicts
+from chalicelib.instrumentation import (
+    json_zip,
+    camelize,
+    query_budget,
+    timed_serialization,
+)
+from chalicelib.codec import (
+    HTTP_CONTENT_ENCODING,
+    b64zip,
+    encode_http_body,
+    negotiate_encoding,
+)
+from chalicelib.response_cache import ResponseCache, etag_matches, make_etag
+from chalicelib.services.LocationMetadataService import (
+    location_metadata,
+    location_metadata_scope,
+)
+from chalicelib.services.HeartbeatService import (
+    get_station_heartbeats,
+    stations_not_pinged_after,
+)
 import os
 import datetime
 import pytz
 import logging
 from dateutil.parser import parse
-from backendlib.helpers.casing_converter import camelize, decamelize
-import base64
-import zlib
+from backendlib.helpers.casing_converter import decamelize
 import json
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, NamedTuple, Optional
 from sqlalchemy.orm import aliased
 
 bp_api = Blueprint(__name__)
@@ -149,6 +171,59 @@ def get_operational_time_window(target_date, timezone_str, detailed_scan_goal):
     return utc_start, utc_end, window_start, window_end
 
 
+# Rows streamed per round trip when scan_details feeds internal callers
+SCAN_FETCH_BATCH_SIZE = int(os.environ.get("SCAN_FETCH_BATCH_SIZE", 5000))
+
+
+class ScanRecord(NamedTuple):
+    """A scan_details row for internal callers, kept as a tuple instead of a dict
+
+    Fields follow the column order of the scan_details query.
+    """
+
+    local_scan_time: datetime.datetime
+    utc_scan_time: datetime.datetime
+    epoch_seconds: float
+    is_clean: bool
+    real_location_id: int
+    real_department_id: Optional[int]
+    real_employee_id: Optional[int]
+    real_station_id: int
+    timezone: str
+    station_id: Any
+    department_id: Any
+    location_id: Any
+    employee_id: Any
+    station_name: str
+    location_name: str
+    department_name: Optional[str]
+    employee_name: Optional[str]
+    has_rewash: bool
+    during_operational_hours: Optional[bool] = None
+
+    @classmethod
+    def from_row(cls, row):
+        record = cls(*row)
+        # Same clean up serialize_row does for dicts, ids of missing rows hash to a value
+        if (
+            record.real_department_id is None
+            or record.real_employee_id is None
+            or record.employee_name == " "
+        ):
+            record = record._replace(
+                department_id=(
+                    None if record.real_department_id is None else record.department_id
+                ),
+                employee_id=(
+                    None if record.real_employee_id is None else record.employee_id
+                ),
+                employee_name=(
+                    None if record.employee_name == " " else record.employee_name
+                ),
+            )
+        return record
+
+
 def serialize_dict(d):
     r = {}
     l = []
@@ -169,12 +244,6 @@ def serialize_dict(d):
     return r or l
 
 
-def b64zip(payload):
-    compressed_bytes = base64.b64encode(zlib.compress(payload.encode("utf-8")))
-    compressed_payload = compressed_bytes.decode("utf-8")
-    return compressed_payload
-
-
 def get_dates_from_query_params(query_params):
     if not query_params or (
         "date" not in query_params
@@ -230,6 +299,146 @@ def get_dates_from_query_params(query_params):
     return start_date, end_date, is_single_date
 
 
+# A day's scans are no longer expected once this long has passed since its midnight,
+# covers every timezone and reset_time of the day's operational window
+CLOSED_DAY_DELAY = datetime.timedelta(days=3)
+__CLOSED_DAY_CACHE = ResponseCache()
+# get_approved_permissions_per_level results of the current /api request
+_request_permissions = ContextVar("api_permissions", default=None)
+
+
+class EncodedResponse(Response):
+    """Response whose body is already in its final /api form, wrap_response sends it as is"""
+
+
+@contextmanager
+def permissions_scope():
+    """Share approved_permissions results with everything run inside the block"""
+    token = _request_permissions.set({})
+    try:
+        yield
+    finally:
+        _request_permissions.reset(token)
+
+
+def approved_permissions(user_id, required_permissions):
+    """get_approved_permissions_per_level for every level, resolved once per request
+
+    closed_day_cache and the handler it wraps ask for the same permissions, the
+    handler reuses the lookup made for the cache key.
+    """
+    resolved = _request_permissions.get()
+    key = (user_id, tuple(sorted(required_permissions)))
+    if resolved is None or key not in resolved:
+        permissions = get_approved_permissions_per_level(
+            user_id=user_id, required_permissions=required_permissions
+        )
+        if resolved is None:
+            return permissions
+        resolved[key] = permissions
+    return resolved[key]
+
+
+def get_scan_version(session, station_ids, start_date, end_date):
+    """Fingerprint of the scans a closed date range can contain
+
+    Changes when late scans land, scans are deleted or any column of a scan is
+    edited: the count, newest id and a sum of whole row hashes are compared.
+
+    Returns:
+        tuple: (count, max id, row hash sum)
+    """
+    return tuple(
+        session.query(
+            func.count(Scan.id),
+            func.max(Scan.id),
+            func.sum(func.hashtext(cast(Scan.__table__.table_valued(), Text))),
+        )
+        .filter(
+            Scan.station_id.in_(station_ids),
+            Scan.created_when >= start_date - datetime.timedelta(days=1),
+            Scan.created_when < end_date + CLOSED_DAY_DELAY,
+        )
+        .one()
+    )
+
+
+def closed_day_cache(endpoint, required_permissions):
+    """Cache an /api handler's result for date ranges whose operational windows have closed
+
+    The ETag covers the endpoint, the caller's approved stations, the query params, the
+    response encoding and the scan version of the range, so If-None-Match is answered
+    with a 304 and a cached body is served without running the handler. Bodies are
+    cached as wrap_response encodes them, a hit is not serialized again. Late, edited
+    or deleted scans change the version and therefore the key. Open dates and internal
+    calls always run the handler. The permissions come from approved_permissions, the
+    handler reuses them.
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(internal_call=False):
+            if internal_call:
+                return f(internal_call=True)
+            request = bp_api.current_request
+            query_params = request.query_params or {}
+            if not any(k in query_params for k in ("date", "start_date", "end_date")):
+                return f()
+            try:
+                start_date, end_date, _ = get_dates_from_query_params(query_params)
+            except (ValueError, BadRequestError):
+                return f()
+            if end_date + CLOSED_DAY_DELAY > datetime.datetime.now():
+                return f()
+
+            user_id = request.context["authorizer"]["principalId"]
+            approved_stations = sorted(
+                approved_permissions(user_id, required_permissions).get("s_ids") or []
+            )
+            if not approved_stations:
+                return f()
+            with get_session() as session:
+                version = get_scan_version(
+                    session, approved_stations, start_date, end_date
+                )
+            raw_response = is_raw_request(query_params)
+            accept_encoding = request.headers.get("accept-encoding")
+            etag = make_etag(
+                endpoint,
+                approved_stations,
+                sorted(query_params.items()),
+                (
+                    negotiate_encoding(accept_encoding)
+                    if raw_response and HTTP_CONTENT_ENCODING
+                    else None
+                ),
+                version,
+            )
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return Response(body="", status_code=304, headers=headers)
+            cached = __CLOSED_DAY_CACHE.get(etag)
+            if cached is None:
+                body = f()
+                if isinstance(body, dict) and "error" in body:
+                    # dfs_metrics reports failures in the body, never cache those
+                    return body
+                body, encoding_headers = encode_api_body(
+                    body, raw_response, accept_encoding
+                )
+                cached = (body, encoding_headers)
+                size = len(body["data"]) if isinstance(body, dict) else len(body)
+                __CLOSED_DAY_CACHE.set(etag, cached, size=size)
+            body, encoding_headers = cached
+            return EncodedResponse(
+                body=body, status_code=200, headers=dict(headers, **encoding_headers)
+            )
+
+        return wrapper
+
+    return decorator
+
+
 @bp_api.middleware("http")
 def wrap_response(event, get_response):
     """Generic wrapper to base64 zip all if it uses /api
@@ -245,30 +454,51 @@ def wrap_response(event, get_response):
     if not bp_api.current_request.context["resourcePath"].startswith("/api"):
         return get_response(event)
 
-    # Check if raw JSON is requested (skip compression)
-    query_params = bp_api.current_request.query_params or {}
-    raw_response = query_params.get("raw", "").lower() in ["true", "1", "yes"]
-
-    response = get_response(event)
+    # Location metadata and permissions are shared by every helper the handler calls
+    with location_metadata_scope(), permissions_scope():
+        response = get_response(event)
     # if not __IS_PROD:
     #     return response
-    if response.status_code != 200:
+    if response.status_code != 200 or isinstance(response, EncodedResponse):
         return response
 
+    response.body, headers = encode_api_body(
+        response.body,
+        is_raw_request(bp_api.current_request.query_params or {}),
+        bp_api.current_request.headers.get("accept-encoding"),
+    )
+    response.headers.update(headers)
+    return response
+
+
+def is_raw_request(query_params):
+    """True when raw JSON is requested instead of the compressed payload"""
+    return query_params.get("raw", "").lower() in ["true", "1", "yes"]
+
+
+def encode_api_body(body, raw_response, accept_encoding):
+    """Final /api response body for a handler result
+
+    Returns:
+        tuple: (body, headers to add to the response)
+    """
     # Skip compression if raw response is requested
     if raw_response:
-        if not isinstance(response.body, str):
-            # Convert to camelCase but don't compress
-            response.body = camelize(response.body)
-        return response
+        if isinstance(body, str):
+            return body, {}
+        # Convert to camelCase, compress only for clients accepting a Content-Encoding
+        with timed_serialization():
+            body, content_encoding = encode_http_body(camelize(body), accept_encoding)
+        headers = {"Content-Type": "application/json"}
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        return body, headers
 
     # Apply normal compression
-    if isinstance(response.body, str):
-        response.body = {"data": b64zip(response.body)}
-    else:
-        response.body = {"data": json_zip(camelize(response.body))}
-
-    return response
+    if isinstance(body, str):
+        with timed_serialization():
+            return {"data": b64zip(body)}, {}
+    return {"data": json_zip(camelize(body))}, {}
 
 
 @bp_api.route("/api-management", methods=["POST"], authorizer=auth)
@@ -371,11 +601,13 @@ def device_status(internal_call=False):
 
 
 @bp_api.route("/api/scan_details", methods=["GET"], authorizer=auth_api)
+@closed_day_cache("scan_details", ["view_handwashes"])
 def scan_details(internal_call=False):
     """Fetch the list of scans on a day
 
     Returns:
         list(dict()): lidst of all scan events on the given day
+        With internal_call the scans of each date are ScanRecord tuples
     """
 
     user_id = bp_api.current_request.context["authorizer"]["principalId"]
@@ -384,9 +616,7 @@ def scan_details(internal_call=False):
         bp_api.current_request.query_params
     )
 
-    permissions = get_approved_permissions_per_level(
-        user_id=user_id, required_permissions=["view_handwashes"]
-    )
+    permissions = approved_permissions(user_id, ["view_handwashes"])
     approved_stations = permissions.get("s_ids")
     approved_locations = permissions.get("l_ids")
 
@@ -435,7 +665,11 @@ def scan_details(internal_call=False):
             .order_by(LOCAL_SCAN_TIME.desc())
         )
 
-        d = q.all()
+        if internal_call:
+            # Plain tuples, SQLAlchemy rows and per scan dicts are never kept
+            d = [ScanRecord.from_row(row) for row in q.yield_per(SCAN_FETCH_BATCH_SIZE)]
+        else:
+            d = q.all()
 
     date_list = [
         start_date + datetime.timedelta(days=x)
@@ -444,7 +678,7 @@ def scan_details(internal_call=False):
 
     data = []
     data_by_target_date = {}
-    l_open, d_open = get_open_close_dicts(approved_locations)
+    l_open, d_open = location_metadata().open_close(approved_locations)
 
     for target_date in date_list:
         # BEGINS TARGET DATE CODE
@@ -510,11 +744,18 @@ def scan_details(internal_call=False):
                     # ovveride the null hashing because that's breaking in SQL alchemy
             return r
 
-        target_date_data = [
-            serialize_row(row, internal_call, dow)
-            for row in d
-            if is_scan_acceptable(row)
-        ]
+        if internal_call:
+            target_date_data = [
+                row._replace(during_operational_hours=is_operational(row))
+                for row in d
+                if is_scan_acceptable(row)
+            ]
+        else:
+            target_date_data = [
+                serialize_row(row, internal_call, dow)
+                for row in d
+                if is_scan_acceptable(row)
+            ]
 
         data = data + target_date_data
         data_by_target_date[target_date.strftime("%Y-%m-%d")] = {
@@ -556,13 +797,23 @@ def calc_employee_gap(start_time, end_time, scan_times):
     return sum(map(lambda x: x**2, gaps)) / sum(gaps)
 
 
-def __calculate_metrics(source_dict, start_times, end_times):
+def __scan_time(scan, pull_date):
+    return dict(
+        local_scan_time=scan.local_scan_time,
+        utc_scan_time=scan.utc_scan_time,
+        epoch_seconds=scan.epoch_seconds,
+        pull_date=pull_date,
+    )
+
+
+def __calculate_metrics(source_dict, start_times, end_times, pull_date):
     """Times are assumed to be localized time. So we can shift to UTC/ get Epoch
 
     Args:
         source_dict (_type_): _description_
         start_times (_type_): _description_
         end_times (_type_): _description_
+        pull_date (str): target date the ScanRecords were pulled for
 
     Returns:
         _type_: _description_
@@ -571,13 +822,13 @@ def __calculate_metrics(source_dict, start_times, end_times):
     for s_id, s_open_close in source_dict.items():
         for k, s_values in s_open_close.items():
             scan_times = list(s_values["scan_time"])
-            scan_times.sort(key=lambda x: x["local_scan_time"])
-            result[s_id][f"{k}_first_scan"] = scan_times[0]
-            result[s_id][f"{k}_last_scan"] = scan_times[-1]
+            scan_times.sort(key=lambda x: x.local_scan_time)
+            result[s_id][f"{k}_first_scan"] = __scan_time(scan_times[0], pull_date)
+            result[s_id][f"{k}_last_scan"] = __scan_time(scan_times[-1], pull_date)
             result[s_id][f"{k}_avg_seconds_between_scans"] = calc_employee_gap(
                 start_time=start_times.get(s_id),
                 end_time=end_times.get(s_id),
-                scan_times=map(lambda x: x["local_scan_time"], scan_times),
+                scan_times=map(lambda x: x.local_scan_time, scan_times),
             )
             result[s_id][f"{k}_total_washes"] = len(scan_times)
             result[s_id][f"{k}_total_contaminated"] = len(
@@ -766,26 +1017,46 @@ def labels_details(
 
 @bp_api.route("/api/sensor_metrics", methods=["GET"], authorizer=auth_api)
 def sensor_metrics(internal_call=False, location_id=None, user_id=None):
+    """Latest reading and alert state of every active sensor at one or many locations
+
+    Query params:
+    - location_id: a single location OR
+    - location_ids: comma-separated list of locations, or "all" for every approved location
+
+    For internal calls location_id may also be a list of location ids.
+    """
     if not internal_call:
         request = bp_api.current_request
         query_params = request.query_params or {}
         user_id = request.context["authorizer"]["principalId"]
-        location_id = query_params.get("location_id")
+        location_id = query_params.get("location_id") or query_params.get(
+            "location_ids"
+        )
     else:
         if not (location_id and user_id):
             return {"error": "Missing required params for internal call"}
 
-    try:
-        location_id = int(location_id)
-    except (ValueError, TypeError):
-        return {"error": "Invalid location_id"}
-
     permissions = get_approved_permissions_per_level(
         user_id=user_id,
         required_permissions=["view_sensors_and_actions"],
     )
     approved_locations = permissions.get("l_ids", [])
-    if not approved_locations or location_id not in approved_locations:
+
+    if location_id == "all":
+        location_ids = list(approved_locations)
+    else:
+        if isinstance(location_id, str):
+            location_id = [l_id for l_id in location_id.split(",") if l_id.strip()]
+        elif not isinstance(location_id, (list, tuple, set)):
+            location_id = [location_id]
+        try:
+            location_ids = [int(l_id) for l_id in location_id]
+        except (ValueError, TypeError):
+            return {"error": "Invalid location_id"}
+        if not location_ids:
+            return {"error": "Invalid location_id"}
+
+    if not approved_locations or not set(location_ids) <= set(approved_locations):
         return {
             "status": "error",
             "message": "User does not have permissions for these locations",
@@ -801,7 +1072,7 @@ def sensor_metrics(internal_call=False, location_id=None, user_id=None):
             .join(DeployedSensor, DeployedSensor.id == SensorData.sensor_id)
             .filter(
                 SensorData.data_type == DeployedSensor.report_data_type,
-                DeployedSensor.location_id == location_id,
+                DeployedSensor.location_id.in_(location_ids),
                 DeployedSensor.active == True,
                 DeployedSensor.sensor_model_id == 2,
             )
@@ -827,7 +1098,7 @@ def sensor_metrics(internal_call=False, location_id=None, user_id=None):
             .outerjoin(
                 sensor_data_sub, DeployedSensor.id == sensor_data_sub.c.sensor_id
             )
-            .filter(DeployedSensor.active == True, Location.id == location_id)
+            .filter(DeployedSensor.active == True, Location.id.in_(location_ids))
             .cte("sensor_max")
         )
 
@@ -848,7 +1119,7 @@ def sensor_metrics(internal_call=False, location_id=None, user_id=None):
             .filter(
                 SensorAction.active == True,
                 DeployedSensor.active == True,
-                DeployedSensor.location_id == location_id,
+                DeployedSensor.location_id.in_(location_ids),
             )
             .group_by(
                 TriggeredAction.sensor_id,
@@ -983,6 +1254,7 @@ def sensor_metrics(internal_call=False, location_id=None, user_id=None):
 
 
 @bp_api.route("/api/location_metrics", methods=["GET"], authorizer=auth_api)
+@closed_day_cache("location_metrics", ["view_devices", "view_handwashes"])
 def location_metrics():
     # TODO query and fill an empty structure for offline locations
     start_date, end_date, is_single_date = get_dates_from_query_params(
@@ -992,10 +1264,8 @@ def location_metrics():
     scan_data_by_target_date = scan_details(internal_call=True)
     user_id = bp_api.current_request.context["authorizer"]["principalId"]
 
-    approved = get_approved_permissions_per_level(
-        user_id=user_id,
-        required_permissions=["view_devices", "view_handwashes"],
-        output_level="l_ids",
+    approved = approved_permissions(user_id, ["view_devices", "view_handwashes"]).get(
+        "l_ids"
     )
 
     if not approved:
@@ -1053,61 +1323,55 @@ def location_metrics():
         s_to_d = {}
         # I get screwed by No departments.
         for scan in scans:
-            d_id = scan["real_department_id"]
-            l_id = scan["real_location_id"]
-            s_id = scan["real_station_id"]
-            e_id = scan["real_employee_id"]
-            anonymized_ids[l_id] = scan["location_id"]
-            anonymized_ids[d_id] = scan["department_id"]
+            d_id = scan.real_department_id
+            l_id = scan.real_location_id
+            s_id = scan.real_station_id
+            e_id = scan.real_employee_id
+            anonymized_ids[l_id] = scan.location_id
+            anonymized_ids[d_id] = scan.department_id
             # Pre allocate our result structure based on all scans
-            ret["locations"][l_id]["location_name"] = scan["location_name"]
-            ret["locations"][l_id]["location_id"] = scan["location_id"]
-            ret["locations"][l_id]["timezone"] = scan["timezone"]
+            ret["locations"][l_id]["location_name"] = scan.location_name
+            ret["locations"][l_id]["location_id"] = scan.location_id
+            ret["locations"][l_id]["timezone"] = scan.timezone
 
             if d_id is not None:
                 d_parent[d_id] = l_id
                 s_to_d[s_id] = d_id
-                ret["locations"][l_id]["departments"][d_id]["department_name"] = scan[
+                ret["locations"][l_id]["departments"][d_id][
                     "department_name"
-                ]
-                ret["locations"][l_id]["departments"][d_id]["department_id"] = scan[
+                ] = scan.department_name
+                ret["locations"][l_id]["departments"][d_id][
                     "department_id"
-                ]
+                ] = scan.department_id
                 ret["locations"][l_id]["departments"][d_id]["stations"][s_id][
                     "station_name"
-                ] = scan["station_name"]
+                ] = scan.station_name
                 ret["locations"][l_id]["departments"][d_id]["stations"][s_id][
                     "station_id"
-                ] = scan["station_id"]
+                ] = scan.station_id
 
             else:
-                ret["locations"][l_id]["stations"][s_id]["station_name"] = scan[
+                ret["locations"][l_id]["stations"][s_id][
                     "station_name"
-                ]
-                ret["locations"][l_id]["stations"][s_id]["station_id"] = scan[
-                    "station_id"
-                ]
+                ] = scan.station_name
+                ret["locations"][l_id]["stations"][s_id]["station_id"] = scan.station_id
 
             s_parent[s_id] = l_id
 
-            scan_time = dict(
-                local_scan_time=scan["local_scan_time"],
-                utc_scan_time=scan["utc_scan_time"],
-                epoch_seconds=scan["epoch_seconds"],
-                pull_date=target_date_key,
-            )
-            is_open = scan["during_operational_hours"]
+            is_open = scan.during_operational_hours
             l_store = location_stores[l_id]
             d_store = department_stores[d_id]
             s_store = station_stores[s_id]
             targets = [l_store, d_store, s_store]
-            __store_in_lists(targets, "scan_time", scan_time, is_open)
-            if scan["is_clean"]:
-                __store_in_lists(targets, "clean_times", scan_time, is_open)
+            # The ScanRecord itself is stored, __calculate_metrics builds the few
+            # first/last scan dicts that are returned
+            __store_in_lists(targets, "scan_time", scan, is_open)
+            if scan.is_clean:
+                __store_in_lists(targets, "clean_times", scan, is_open)
             else:
-                __store_in_lists(targets, "contam_times", scan_time, is_open)
-                if scan["has_rewash"]:
-                    __store_in_lists(targets, "rewash_times", scan_time, is_open)
+                __store_in_lists(targets, "contam_times", scan, is_open)
+                if scan.has_rewash:
+                    __store_in_lists(targets, "rewash_times", scan, is_open)
 
         department_stores = department_stores.to_dict()
         location_stores = location_stores.to_dict()
@@ -1127,13 +1391,22 @@ def location_metrics():
             station_close[s_id] = d_close[d_id]
 
         location_result = __calculate_metrics(
-            location_stores, start_times=l_start, end_times=l_close
+            location_stores,
+            start_times=l_start,
+            end_times=l_close,
+            pull_date=target_date_key,
         )
         department_results = __calculate_metrics(
-            department_stores, start_times=d_start, end_times=d_close
+            department_stores,
+            start_times=d_start,
+            end_times=d_close,
+            pull_date=target_date_key,
         )
         station_results = __calculate_metrics(
-            station_stores, start_times=station_start, end_times=station_close
+            station_stores,
+            start_times=station_start,
+            end_times=station_close,
+            pull_date=target_date_key,
         )
 
         # move calculated results into the result structure
@@ -1162,6 +1435,8 @@ def location_metrics():
 
 
 @bp_api.route("/api/dfs_metrics", methods=["GET"], authorizer=auth_api)
+@closed_day_cache("dfs_metrics", ["view_handwashes", "view_devices"])
+@query_budget(10, "dfs_metrics")
 def dfs_metrics():
     """DFS metrics API endpoint for McDonald's integration
 
@@ -1205,48 +1480,40 @@ def dfs_metrics():
             return {"error": "Invalid location_ids parameter"}
 
     # Get user's approved locations
-    permissions = get_approved_permissions_per_level(
-        user_id=user_id,
-        required_permissions=["view_handwashes", "view_devices"],
-        output_level="l_ids",
-    )
-    approved_locations = permissions or []
+    permissions = approved_permissions(user_id, ["view_handwashes", "view_devices"])
+    approved_locations = permissions.get("l_ids") or []
 
     if not approved_locations:
         return {"error": "No accessible locations"}
 
     try:
         with get_session() as session:
-            # Build query to get location mappings
-            q = (
-                session.query(
-                    Location.id.label("location_id"),
-                    Location.name.label("location_name"),
-                    Location.timezone,
-                    Location.scan_goal,
-                    Location.detailed_scan_goal,
-                    VendorLocationMapping.dfs_vendor_location_id.label(
-                        "dfs_vendor_location_id"
-                    ),
-                )
-                .select_from(Location)
-                .outerjoin(
-                    VendorLocationMapping,
-                    and_(
-                        VendorLocationMapping.location_id == Location.id,
+            locations = location_metadata().locations(session, approved_locations)
+            if dfs_location_ids:
+                # Only locations mapped to one of the requested vendor location ids
+                vendor_location_ids = dict(
+                    session.query(
+                        VendorLocationMapping.location_id,
+                        VendorLocationMapping.dfs_vendor_location_id,
+                    )
+                    .filter(
                         VendorLocationMapping.active == True,
-                    ),
+                        VendorLocationMapping.location_id.in_(list(locations)),
+                        VendorLocationMapping.dfs_vendor_location_id.in_(
+                            dfs_location_ids
+                        ),
+                    )
+                    .order_by(VendorLocationMapping.id)
                 )
-                .filter(Location.id.in_(approved_locations))
-            )
-
-        # Filter by requested location IDs if provided
-        if dfs_location_ids:
-            q = q.filter(
-                VendorLocationMapping.dfs_vendor_location_id.in_(dfs_location_ids)
-            )
+            else:
+                vendor_location_ids = {
+                    location_id: (location.dfs_vendor_location_ids or (None,))[-1]
+                    for location_id, location in locations.items()
+                }
 
-        location_mappings = {row.location_id: row for row in q.all()}
+        location_mappings = {
+            location_id: locations[location_id] for location_id in vendor_location_ids
+        }
 
         if not location_mappings:
             return {"error": "No matching locations found"}
@@ -1259,17 +1526,21 @@ def dfs_metrics():
         ]
 
         # Get scan data for all dates
-        all_scan_data = {}
         all_device_data = {}
 
+        all_scan_data = get_location_scan_metrics_for_dates(
+            session, list(location_mappings.keys()), date_list, location_mappings
+        )
+        # Last pings are read once and checked against every date's window
+        heartbeats = get_station_heartbeats(session, list(location_mappings.keys()))
         for target_date in date_list:
-            scan_data = get_location_scan_metrics(
-                session, list(location_mappings.keys()), target_date
-            )
             device_statuses = get_device_status_for_locations(
-                session, list(location_mappings.keys()), target_date
+                session,
+                list(location_mappings.keys()),
+                target_date,
+                location_mappings,
+                heartbeats,
             )
-            all_scan_data[target_date] = scan_data
             all_device_data[target_date] = device_statuses
 
         # Group by location
@@ -1324,7 +1595,7 @@ def dfs_metrics():
 
             # Create location object with locationUuid and dates array
             location_result = {
-                "locationUuid": mapping.dfs_vendor_location_id,
+                "locationUuid": vendor_location_ids[location_id],
                 "dates": date_entries,
             }
             results.append(location_result)
@@ -1340,36 +1611,52 @@ def get_location_scan_metrics(
 ):
     """Get scan metrics for specified locations on a given date
 
-    IMPORTANT: This function needs to be called per location with proper timezone handling
-    since each location may have different timezones and reset_times affecting the UTC scan time range.
+    Each location may have a different timezone and reset_time, so each gets its own
+    operational UTC window, all evaluated in a single query.
     """
-    # Get location timezone and detailed_scan_goal info first
-    location_tz_query = session.query(
-        Location.id.label("location_id"), Location.timezone, Location.detailed_scan_goal
-    ).filter(Location.id.in_(location_ids))
+    return get_location_scan_metrics_for_dates(
+        session, location_ids, [target_date], locations=location_mappings
+    )[target_date]
 
-    location_data = {row.location_id: row for row in location_tz_query.all()}
 
-    results = {}
-
-    # Process each location separately due to timezone and reset_time differences
-    for location_id in location_ids:
-        location_info = location_data.get(location_id)
-        timezone_str = location_info.timezone if location_info else "UTC"
-        detailed_scan_goal = location_info.detailed_scan_goal if location_info else None
+def get_location_scan_metrics_for_dates(
+    session, location_ids, target_dates, locations=None
+):
+    """Scan and contamination event metrics for every location and date in one query
 
-        # Get operational time window based on reset_time for this day of week
-        utc_start, utc_end, local_start, local_end = get_operational_time_window(
-            target_date, timezone_str, detailed_scan_goal
-        )
+    Returns:
+        dict: target_date -> location_id -> metrics, see analyze_contamination_events
+    """
+    location_data = (
+        locations
+        if locations is not None
+        else location_metadata().locations(session, location_ids)
+    )
 
-        # Query scans for contamination event analysis using event_list
-        contamination_data = analyze_contamination_events(
-            session, location_id, utc_start, utc_end
-        )
-        results[location_id] = contamination_data
+    windows = []
+    for target_date in target_dates:
+        for location_id in location_ids:
+            location_info = location_data.get(location_id)
+            timezone_str = location_info.timezone if location_info else "UTC"
+            detailed_scan_goal = (
+                location_info.detailed_scan_goal if location_info else None
+            )
+            # Get operational time window based on reset_time for this day of week
+            utc_start, utc_end, _, _ = get_operational_time_window(
+                target_date, timezone_str, detailed_scan_goal
+            )
+            windows.append(
+                (location_id, target_date.strftime("%Y-%m-%d"), utc_start, utc_end)
+            )
 
-    return results
+    metrics = get_contamination_metrics(session, windows)
+    return {
+        target_date: {
+            location_id: metrics[(location_id, target_date.strftime("%Y-%m-%d"))]
+            for location_id in location_ids
+        }
+        for target_date in target_dates
+    }
 
 
 def analyze_contamination_events(session, location_id, utc_start, utc_end):
@@ -1382,22 +1669,26 @@ def analyze_contamination_events(session, location_id, utc_start, utc_end):
     Returns:
         dict: Contains total_scans, clean_scans, contamination_events, resolved_events, unresolved_events
     """
+    return get_contamination_metrics(
+        session, [(location_id, "window", utc_start, utc_end)]
+    )[(location_id, "window")]
 
-    # Get basic scan counts and contaminated scans with their event_list
-    scans_query = (
-        session.query(Scan.id, Scan.result, Scan.event_list)
-        .join(Station, Station.id == Scan.station_id)
-        .filter(
-            Station.location_id == location_id,
-            Station.active == True,
-            Scan.created_when >= utc_start,
-            Scan.created_when < utc_end,
-            HANDS_PRESENT,
-        )
-    ).all()
 
-    if not scans_query:
-        return {
+def get_contamination_metrics(session, windows):
+    """Contamination event metrics for many location windows, aggregated in SQL
+
+    Contaminated scans sharing an event_list form one contamination event. The event
+    is resolved when the last scan of its event_list is clean and was taken in the
+    same location window, as analyze_contamination_events always did in Python.
+
+    Args:
+        windows (list(tuple)): (location_id, window_key, utc_start, utc_end)
+
+    Returns:
+        dict: (location_id, window_key) -> metrics dict, zeros for windows without scans
+    """
+    ret = {
+        (location_id, window_key): {
             "location_id": location_id,
             "total_scans": 0,
             "clean_scans": 0,
@@ -1406,61 +1697,100 @@ def analyze_contamination_events(session, location_id, utc_start, utc_end):
             "resolved_events": 0,
             "unresolved_events": 0,
         }
-
-    # Process scans
-    total_scans = len(scans_query)
-    clean_scans = sum(1 for scan in scans_query if scan.result == 0)
-    contaminated_scans = sum(1 for scan in scans_query if scan.result == 1)
-    contamination_events = 0
-    resolved_events = 0
-    unresolved_events = 0
-
-    # Create a lookup for scan results by ID
-    scan_results = {scan.id: scan.result for scan in scans_query}
-
-    # Group scans by their event_list to identify unique contamination events
-    event_chains = {}
-    for scan in scans_query:
-        if scan.result == 1 and scan.event_list:
-            event_key = tuple(scan.event_list)
-            if event_key not in event_chains:
-                event_chains[event_key] = []
-            event_chains[event_key].append(scan)
-
-    # Process each unique contamination event
-    for event_list, scans_in_event in event_chains.items():
-        contamination_events += 1
-
-        final_event_id = event_list[-1]
-        final_result = scan_results.get(final_event_id)
-
-        if final_result == 0:
-            resolved_events += 1
-        else:
-            unresolved_events += 1
-
-    return {
-        "location_id": location_id,
-        "total_scans": total_scans,
-        "clean_scans": clean_scans,
-        "contaminated_scans": contaminated_scans,
-        "contamination_events": contamination_events,
-        "resolved_events": resolved_events,
-        "unresolved_events": unresolved_events,
+        for location_id, window_key, _, _ in windows
     }
+    if not windows:
+        return ret
+
+    scan_windows = values(
+        column("location_id", Station.location_id.type),
+        column("window_key", String()),
+        column("utc_start", Scan.created_when.type),
+        column("utc_end", Scan.created_when.type),
+        name="scan_windows",
+    ).data(windows)
+    window_scans = (
+        session.query(
+            Scan.id,
+            Scan.result,
+            Scan.event_list,
+            scan_windows.c.location_id,
+            scan_windows.c.window_key,
+        )
+        .join(Station, Station.id == Scan.station_id)
+        .join(
+            scan_windows,
+            and_(
+                scan_windows.c.location_id == Station.location_id,
+                Scan.created_when >= scan_windows.c.utc_start,
+                Scan.created_when < scan_windows.c.utc_end,
+            ),
+        )
+        .filter(Station.active == True, HANDS_PRESENT)
+        .subquery()
+    )
+    final_scan = window_scans.alias("final_scan")
+    in_event = and_(
+        window_scans.c.result == 1, func.cardinality(window_scans.c.event_list) > 0
+    )
+    q = (
+        session.query(
+            window_scans.c.location_id,
+            window_scans.c.window_key,
+            func.count().label("total_scans"),
+            func.count().filter(window_scans.c.result == 0).label("clean_scans"),
+            func.count().filter(window_scans.c.result == 1).label("contaminated_scans"),
+            func.count(distinct(window_scans.c.event_list))
+            .filter(in_event)
+            .label("contamination_events"),
+            func.count(distinct(window_scans.c.event_list))
+            .filter(and_(in_event, final_scan.c.result == 0))
+            .label("resolved_events"),
+        )
+        .outerjoin(
+            final_scan,
+            and_(
+                final_scan.c.id
+                == window_scans.c.event_list[
+                    func.cardinality(window_scans.c.event_list)
+                ],
+                final_scan.c.location_id == window_scans.c.location_id,
+                final_scan.c.window_key == window_scans.c.window_key,
+            ),
+        )
+        .group_by(window_scans.c.location_id, window_scans.c.window_key)
+    )
+    for row in q:
+        ret[(row.location_id, row.window_key)].update(
+            total_scans=row.total_scans,
+            clean_scans=row.clean_scans,
+            contaminated_scans=row.contaminated_scans,
+            contamination_events=row.contamination_events,
+            resolved_events=row.resolved_events,
+            unresolved_events=row.contamination_events - row.resolved_events,
+        )
+    return ret
 
 
-def get_device_status_for_locations(session, location_ids, target_date):
+def get_device_status_for_locations(
+    session, location_ids, target_date, locations=None, heartbeats=None
+):
     """Get device status for offline detection
 
-    Check if devices were offline since before the end of the operational window
+    Check if devices were offline since before the end of the operational window.
+    Callers checking several dates pass the get_station_heartbeats result as heartbeats.
     """
-    # Get location timezone and detailed_scan_goal info first
-    location_tz_query = session.query(
-        Location.id.label("location_id"), Location.timezone, Location.detailed_scan_goal
-    ).filter(Location.id.in_(location_ids))
-
-    location_data = {row.location_id: row for row in location_tz_query.all()}
+    # Location timezone and detailed_scan_goal, loaded once per request
+    location_data = (
+        locations
+        if locations is not None
+        else location_metadata().locations(session, location_ids)
+    )
+    station_heartbeats = (
+        heartbeats
+        if heartbeats is not None
+        else get_station_heartbeats(session, location_ids)
+    )
 
     results = {}
 
@@ -1476,44 +1806,19 @@ def get_device_status_for_locations(session, location_ids, target_date):
         )
 
         # Check that ALL devices have pinged AFTER the reference end time
-        q = (
-            session.query(
-                Location.id.label("location_id"),
-                func.count(Station.id).label("total_stations"),
-                func.count(DeviceStatus.id).label("stations_with_status"),
-                func.count(
-                    case(
-                        [(DeviceStatus.status_when > utc_end_of_day, Station.id)],
-                        else_=None,
-                    )
-                ).label("stations_with_pings_after_end"),
-            )
-            .select_from(Location)
-            .join(Station, Station.location_id == Location.id)
-            .outerjoin(
-                DeviceStatusMostRecent, DeviceStatusMostRecent.station_id == Station.id
-            )
-            .outerjoin(
-                DeviceStatus, DeviceStatus.id == DeviceStatusMostRecent.device_status_id
-            )
-            .filter(Location.id == location_id, Station.active == True)
-            .group_by(Location.id)
-        )
-
-        result = q.first()
-        if result:
-            result_dict = dict(result)
-            result_dict["reference_end_time"] = utc_end_of_day
-            results[location_id] = result_dict
-        else:
-            # No device data found
-            results[location_id] = {
-                "location_id": location_id,
-                "total_stations": 0,
-                "stations_with_status": 0,
-                "stations_with_pings_after_end": 0,
-                "reference_end_time": utc_end_of_day,
-            }
+        location_heartbeats = station_heartbeats.get(location_id, ())
+        results[location_id] = {
+            "location_id": location_id,
+            "total_stations": len(location_heartbeats),
+            "stations_with_status": sum(
+                1
+                for heartbeat in location_heartbeats
+                if heartbeat.last_ping_utc is not None
+            ),
+            "stations_with_pings_after_end": len(location_heartbeats)
+            - len(stations_not_pinged_after(location_heartbeats, utc_end_of_day)),
+            "reference_end_time": utc_end_of_day,
+        }
 
     return results
 
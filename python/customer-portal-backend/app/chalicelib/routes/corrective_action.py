@@ -1,3 +1,4 @@
+import base64
 import datetime
 import logging
 from datetime import timedelta
@@ -10,8 +11,8 @@ from backendlib.utils import parse_and_decamlize_params
 from backendlib.utils import extract_filter_primary_key_and_vals
 from backendlib.sessionmanager import get_session, render_query
 from sqlalchemy import func, or_, and_
-from backendlib.utils import format_as_java_time, json_zip
-from backendlib.helpers.casing_converter import camelize
+from backendlib.utils import format_as_java_time
+from chalicelib.instrumentation import json_zip, camelize
 from backendlib.utils import decamelize
 from backendlib.helpers.defaulter_dict import DefaultingDictList
 from backendlib.helpers.android_lambda_helper import request_android_config
@@ -49,6 +50,10 @@ def __convert_level_to_filters(arg_key):
 
 bp_corrective_action = Blueprint(__name__)
 
+MAX_ALERT_PAGE_SIZE = 1000
+# group_by values accepted by mode=summary
+ALERT_SUMMARY_GROUPS = ("day", "category", "criticality", "sensor")
+
 @bp_corrective_action.route("/sensor_alerts", methods=["GET"], authorizer=auth)
 def get_corrective_action():
     user_id = get_authorized_user_id(bp_corrective_action.current_request)
@@ -75,6 +80,25 @@ def get_corrective_action():
     if criticality:
         filter_args.append(SensorAction.criticality == criticality)
 
+    if args.get("mode") == "summary":
+        return __get_alert_summary(args, filter_args)
+
+    limit = args.get("limit")
+    if limit is not None:
+        try:
+            limit = min(int(limit), MAX_ALERT_PAGE_SIZE)
+        except ValueError:
+            raise BadRequestError("limit must be a number")
+        if limit < 1:
+            raise BadRequestError("limit must be positive")
+    after = args.get("after")
+    if after:
+        after_created_when, after_id = __decode_alert_cursor(after)
+        # keyset pagination, newest first
+        filter_args.append(or_(TriggeredAction.created_when < after_created_when,
+                               and_(TriggeredAction.created_when == after_created_when,
+                                    TriggeredAction.id < after_id)))
+
     with get_session() as session:
         q = session.query(
             func.timezone(Location.timezone, TriggeredAction.alert_start_when).label("alert_start_when"),
@@ -92,7 +116,8 @@ def get_corrective_action():
             DeployedSensor.name.label("sensor_name"),
             Department.name.label("department_name"),
             Location.name.label("location_name"),
-            SensorAction.data_type.label("event_type")
+            SensorAction.data_type.label("event_type"),
+            TriggeredAction.created_when.label("utc_created_when"),
         ).join(
             SensorAction, SensorAction.id == TriggeredAction.sensor_action_id
         ).join(
@@ -104,12 +129,84 @@ def get_corrective_action():
         ).filter(
             *filter_args
         )
-        return dict(data=json_zip([ camelize (dict(row, alert_start_when=format_as_java_time(row.alert_start_when),
-                          created_when=format_as_java_time(row.created_when)
-                          ) ) for row in q]))
-        
+        paginated = limit is not None or bool(after)
+        next_cursor = None
+        if not paginated:
+            rows = q.all()
+        else:
+            limit = limit or MAX_ALERT_PAGE_SIZE
+            # one extra row tells whether there is a next page
+            rows = q.order_by(TriggeredAction.created_when.desc(), TriggeredAction.id.desc()).limit(limit + 1).all()
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = __encode_alert_cursor(rows[-1].utc_created_when, rows[-1].triggered_action_id)
+        data = [camelize(dict({k: v for k, v in dict(row).items() if k != "utc_created_when"},
+                              alert_start_when=format_as_java_time(row.alert_start_when),
+                              created_when=format_as_java_time(row.created_when)))
+                for row in rows]
+        if not paginated:
+            return dict(data=json_zip(data))
+        return dict(data=json_zip(data), nextCursor=next_cursor)
+
+
+def __encode_alert_cursor(created_when, triggered_action_id):
+    # opaque and url safe, isoformat's "+" would otherwise need escaping in the query string
+    return base64.urlsafe_b64encode(f"{created_when.isoformat()}|{triggered_action_id}".encode()).decode()
 
 
+def __decode_alert_cursor(cursor):
+    try:
+        created_when, triggered_action_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return parse(created_when), int(triggered_action_id)
+    except (ValueError, OverflowError, UnicodeError):
+        raise BadRequestError("Invalid after cursor")
 
 
-    
\ No newline at end of file
+def __get_alert_summary(args, filter_args):
+    """Alert counts, durations and out of range totals aggregated in SQL
+
+    group_by is a comma separated subset of ALERT_SUMMARY_GROUPS, default day,category,criticality.
+    day is the location's local date of the alert.
+    """
+    group_by = [g.strip() for g in (args.get("group_by") or "day,category,criticality").split(",") if g.strip()]
+    unknown = set(group_by) - set(ALERT_SUMMARY_GROUPS)
+    if unknown:
+        raise BadRequestError(f"Invalid group_by: {', '.join(sorted(unknown))}")
+    local_created_when = func.timezone(Location.timezone, TriggeredAction.created_when)
+    group_columns = {
+        "day": [func.date(local_created_when).label("day")],
+        "category": [DeployedSensor.tag[1].label("category")],
+        "criticality": [SensorAction.criticality.label("criticality")],
+        "sensor": [DeployedSensor.id.label("sensor_id"), DeployedSensor.name.label("sensor_name")],
+    }
+    columns = [c for g in group_by for c in group_columns[g]]
+    duration = func.extract("epoch", TriggeredAction.created_when - TriggeredAction.alert_start_when)
+
+    with get_session() as session:
+        q = session.query(
+            *columns,
+            func.count(TriggeredAction.id).label("alert_count"),
+            func.count(TriggeredAction.id).filter(TriggeredAction.is_out_of_range == True).label("out_of_range_count"),
+            func.sum(duration).label("total_duration_seconds"),
+            func.avg(duration).label("average_duration_seconds"),
+            func.max(duration).label("max_duration_seconds"),
+        ).join(
+            SensorAction, SensorAction.id == TriggeredAction.sensor_action_id
+        ).join(
+            DeployedSensor, DeployedSensor.id == TriggeredAction.sensor_id
+        ).join(
+            Location, Location.id == DeployedSensor.location_id
+        ).filter(
+            *filter_args
+        )
+        if columns:
+            q = q.group_by(*columns).order_by(*columns)
+        data = []
+        for row in q:
+            row = dict(row)
+            if row.get("day") is not None:
+                row["day"] = row["day"].isoformat()
+            for k in ("total_duration_seconds", "average_duration_seconds", "max_duration_seconds"):
+                row[k] = float(row[k]) if row[k] is not None else None
+            data.append(camelize(row))
+        return dict(data=json_zip(data))
@@ -3,6 +3,7 @@ from chalicelib.services import PermissionService
 from chalicelib.services.GoalService import GoalService
 from chalicelib.services import LocationService
 from chalicelib.authorizer import auth
+from chalicelib.instrumentation import query_budget
 import leangle
 from chalicelib.authorizer import get_authorized_user_id, get_agent_data, get_admin_pw_flag
 from chalicelib.services.logging.DataInteractionLoggerService import DataInteractionLoggerService
@@ -73,6 +74,7 @@ def get_my_location_details(locationId):
 
 
 @bp_locations.route('/my-locations/{locationId}', methods=['POST'], authorizer=auth)
+@query_budget(15, "update_location")
 def update_location(locationId):
 
     user_id = current_user_id()
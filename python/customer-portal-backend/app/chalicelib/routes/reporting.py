@@ -1,14 +1,16 @@
 import datetime
-from chalice import Blueprint
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from chalice import Blueprint, BadRequestError
 from chalicelib.authorizer import auth
 from chalicelib.authorizer import get_authorized_user_id
 from chalicelib.services.PermissionService import (
     get_approved_permissions_per_level,
 )
 from backendlib.sessionmanager import get_session, render_query
-from sqlalchemy import func, or_, and_, case, any_
-from backendlib.utils import json_zip
-from backendlib.helpers.casing_converter import camelize
+from sqlalchemy import func, or_, and_, any_
+from chalicelib.instrumentation import json_zip, camelize, query_budget
+from chalicelib.services import LocationService
 from backendlib.utils import decamelize
 
 from backendlib.models import (
@@ -16,7 +18,6 @@ from backendlib.models import (
     ApprovalLog,
     Customer,
     DeployedSensor,
-    Department,
     Location,
     SensorData,
     WebappUser,
@@ -32,8 +33,25 @@ DEFAULT_TEMP_LIMITS_C = {
     "freezer": {"high": -15, "low": None},
 }
 
+TIME_Q_STR_FORMAT = "%Y-%m-%d %H:%M:%S"
+# SensorData columns selected for A3 report readings
+__READING_COLUMNS = (
+    "sensor_reading",
+    "sensor_unit",
+    "created_when",
+    "local_created_when",
+    "reading_id",
+)
+# Longest date range served by /reporting/approve-report/bulk
+MAX_BULK_REPORT_DAYS = 31
+# Dates whose readings are held in memory together, each chunk is fetched separately
+REPORT_READINGS_CHUNK_DAYS = 7
+# Minimum continuous out of range duration that fails a check
+OOR_INTERVAL = datetime.timedelta(hours=2)
+
 
 def check_unit_type_has_limits(unit_type):
+    matching_keys = []
     if unit_type is not None:
         category = unit_type.lower()
 
@@ -84,6 +102,18 @@ def list_locations():
     )
     ret = dict()
     with get_session() as session:
+        # Active sensors are counted per location before the join, joining them next
+        # to departments returned departments x sensors rows
+        sensor_counts = (
+            session.query(
+                DeployedSensor.location_id,
+                func.count(DeployedSensor.id).label("sensor_count"),
+            )
+            .filter(DeployedSensor.location_id.in_(l_ids))
+            .filter(DeployedSensor.active == True)
+            .group_by(DeployedSensor.location_id)
+            .subquery()
+        )
         q = (
             session.query(
                 Customer.id.label("customer_id"),
@@ -91,45 +121,30 @@ def list_locations():
                 Location.id.label("location_id"),
                 Location.name.label("location_name"),
                 Location.timezone.label("timezone"),
-                Department.id.label("department_id"),
-                Department.name.label("department_name"),
-                func.sum(
-                    case(value=DeployedSensor.active, whens={True: 1}, else_=0)
-                ).label("sensor_count"),
+                func.coalesce(sensor_counts.c.sensor_count, 0).label("sensor_count"),
             )
             .join(Customer, Customer.id == Location.customer_id)
-            .outerjoin(Department, Department.location_id == Location.id)
-            .outerjoin(
-                DeployedSensor,
-                DeployedSensor.location_id == Location.id
-                and DeployedSensor.active == True,
-            )
+            .outerjoin(sensor_counts, sensor_counts.c.location_id == Location.id)
             .filter(Location.id.in_(l_ids))
-            .group_by(
-                Customer.id,
-                Location.id,
-                Department.id,
-            )
         )
+        departments = LocationService.get_departments_by_location(session, l_ids)
         for row in q:
-            if row.location_id not in ret:
-                ret[row.location_id] = {}
-            ret[row.location_id]["location_id"] = row.location_id
-            ret[row.location_id]["location_name"] = row.location_name
-            ret[row.location_id]["timezone"] = row.timezone
-            ret[row.location_id]["sensor_count"] = row.sensor_count
-            ret[row.location_id]["customer_id"] = row.customer_id
-            ret[row.location_id]["customer_name"] = row.customer_name
-            departments_key = "departments"
-            if row.department_id is not None:
-                if ret[row.location_id].get(departments_key, None) is None:
-                    ret[row.location_id][departments_key] = []
-                ret[row.location_id][departments_key].append(
+            ret[row.location_id] = dict(
+                location_id=row.location_id,
+                location_name=row.location_name,
+                timezone=row.timezone,
+                sensor_count=row.sensor_count,
+                customer_id=row.customer_id,
+                customer_name=row.customer_name,
+            )
+            if row.location_id in departments:
+                ret[row.location_id]["departments"] = [
                     {
-                        "department_name": row.department_name,
-                        "department_id": row.department_id,
+                        "department_name": department_name,
+                        "department_id": department_id,
                     }
-                )
+                    for department_id, department_name in departments[row.location_id]
+                ]
 
     return_items = [camelize(value) for value in list(ret.values())]
     return dict(data=json_zip(return_items))
@@ -226,6 +241,7 @@ def approve_a_day():
 
 
 @bp_reporting.route("/reporting/approve-report", methods=["GET"], authorizer=auth)
+@query_budget(10, "get_a_day")
 def get_a_day():
     """
         Get a given reports approval day
@@ -275,44 +291,17 @@ def get_a_day():
         )
 
     with get_session() as session:
-        """
-        Get the most recent signed logs for each sensor, config, index combo
-        """
         approval_log = [
-            dict(
-                a._as_dict(),
-                signer_name=f"{first_name} {last_name}",
-                reading_when=reading_when,
-                reading_value=reading_value,
-                reading_id=r_id,
-            )
-            for a, reading_when, reading_value, r_id, first_name, last_name in session.query(
-                ApprovalLog,
-                SensorData.created_when.label("reading_when"),
-                SensorData.sensor_value.label("reading_value"),
-                SensorData.id.label("reading_id"),
-                WebappUser.first_name,
-                WebappUser.last_name,
-            )
-            .distinct(
-                ApprovalLog.sensor_id,
-                ApprovalLog.report_config_entry_index,
-                ApprovalLog.report_config_id,
-            )
-            .join(DeployedSensor, DeployedSensor.id == ApprovalLog.sensor_id)
-            .join(WebappUser, WebappUser.id == ApprovalLog.signer_id)
-            .outerjoin(SensorData, SensorData.id == ApprovalLog.reading_id)
-            .filter(
-                ApprovalLog.report_date == request_date,
-                ApprovalLog.report_config_id == args["report_id"],
-                or_(l_id is None, l_id == DeployedSensor.location_id),
-                or_(d_id is None, d_id == DeployedSensor.department_id),
-            )
-            .order_by(
-                ApprovalLog.sensor_id,
-                ApprovalLog.report_config_entry_index,
-                ApprovalLog.report_config_id,
-                ApprovalLog.signed_when.desc(),
+            approval
+            for approval, _, _ in __get_approval_logs(
+                session=session,
+                report_id=args["report_id"],
+                start_date=request_date,
+                end_date=request_date,
+                filters=[
+                    or_(l_id is None, l_id == DeployedSensor.location_id),
+                    or_(d_id is None, d_id == DeployedSensor.department_id),
+                ],
             )
         ]
         payload = dict(
@@ -323,6 +312,228 @@ def get_a_day():
         return dict(data=json_zip(camelize(payload)))
 
 
+@bp_reporting.route("/reporting/approve-report/bulk", methods=["GET"], authorizer=auth)
+@query_budget(15, "get_report_days")
+def get_report_days():
+    """
+        Get a given reports approval days for a date range and a set of departments in one request
+        Expects: Report_id, Start_date, End_date and Location_id and/or Department_ids (comma separated)
+
+        Readings and approvals are fetched once for the whole range and split per day
+        and per section. A location section covers every sensor in the location, a
+        department section only that department's sensors, as in get_a_day.
+    Returns:
+        dict(): {
+            report_timing: JSON -- relevant fields are table, and checks
+            days: [{
+                date,
+                sections: [{
+                    location_id,
+                    department_id -- None for the location section
+                    readings: [... same as get_a_day]
+                    signed: [ApprovalLogs +signer_name for that date and section]
+                }]
+            } ... ]
+        }
+    """
+    args = decamelize(bp_reporting.current_request.query_params)
+    if int(args["report_id"]) not in report_list_helper():
+        raise Exception("You do not have permission to use this report")
+
+    user_id = get_authorized_user_id(bp_reporting.current_request)
+    try:
+        l_id = int(args["location_id"]) if args.get("location_id") else None
+        d_ids = [int(d) for d in args.get("department_ids", "").split(",") if d.strip()]
+    except ValueError:
+        raise BadRequestError("location_id and department_ids must be integers")
+    if not l_id and not d_ids:
+        raise BadRequestError("A location_id or department_ids are required")
+    try:
+        start_date = datetime.datetime.strptime(args["start_date"], "%Y-%m-%d")
+        end_date = datetime.datetime.strptime(args["end_date"], "%Y-%m-%d")
+    except (KeyError, ValueError):
+        raise BadRequestError("start_date and end_date are required as YYYY-MM-DD")
+    n_days = (end_date - start_date).days + 1
+    if n_days < 1 or n_days > MAX_BULK_REPORT_DAYS:
+        raise BadRequestError(
+            f"Date range must be between 1 and {MAX_BULK_REPORT_DAYS} days"
+        )
+
+    scope = []
+    sections = []
+    if l_id:
+        approved = get_approved_permissions_per_level(
+            user_id=user_id,
+            required_permissions=["generate_reports"],
+            output_level="l_ids",
+            ids=[l_id],
+        )
+        if not approved:
+            raise Exception(
+                f"Invalid request missing permission for the given parameters {user_id}"
+            )
+        scope.append(DeployedSensor.location_id == l_id)
+        sections.append((l_id, None))
+    if d_ids:
+        approved = get_approved_permissions_per_level(
+            user_id=user_id,
+            required_permissions=["generate_reports"],
+            output_level="d_ids",
+            ids=d_ids,
+        )
+        if set(d_ids) - set(approved):
+            raise Exception(
+                f"Invalid request missing permission for the given parameters {user_id}"
+            )
+        scope.append(DeployedSensor.department_id.in_(d_ids))
+        sections += [(None, d) for d in d_ids]
+
+    request_dates = [
+        (start_date + datetime.timedelta(days=x)).strftime("%Y-%m-%d")
+        for x in range(n_days)
+    ]
+    with get_session() as session:
+        report_timing, filters = __get_report_filters(
+            session, args["report_id"], [or_(*scope)]
+        )
+        readings_by_date = {}
+        if filters is not None:
+            windows_by_date = {
+                request_date: __get_check_windows(request_date, report_timing["checks"])
+                for request_date in request_dates
+            }
+            readings_by_date = __get_readings_for_dates(
+                session, filters, windows_by_date
+            )
+
+        approvals_by_date = defaultdict(list)
+        for approval, a_l_id, a_d_id in __get_approval_logs(
+            session=session,
+            report_id=args["report_id"],
+            start_date=request_dates[0],
+            end_date=request_dates[-1],
+            filters=[or_(*scope)],
+        ):
+            approvals_by_date[approval["report_date"].strftime("%Y-%m-%d")].append(
+                (approval, a_l_id, a_d_id)
+            )
+
+    days = []
+    for request_date in request_dates:
+        day_readings = readings_by_date.get(request_date, [])
+        day_approvals = approvals_by_date[request_date]
+        days.append(
+            dict(
+                date=request_date,
+                sections=[
+                    dict(
+                        location_id=section[0],
+                        department_id=section[1],
+                        readings=[
+                            r
+                            for r in day_readings
+                            if __in_section(
+                                section, r["location_id"], r["department_id"]
+                            )
+                        ],
+                        signed=[
+                            a
+                            for a, a_l_id, a_d_id in day_approvals
+                            if __in_section(section, a_l_id, a_d_id)
+                        ],
+                    )
+                    for section in sections
+                ],
+            )
+        )
+    return dict(data=json_zip(camelize(dict(report_timing=report_timing, days=days))))
+
+
+def __in_section(section, location_id, department_id):
+    """True when a row of location_id and department_id belongs to a bulk report section
+
+    A location section (location_id, None) covers the whole location, a department
+    section (None, department_id) only that department.
+    """
+    section_l_id, section_d_id = section
+    if section_d_id is not None:
+        return department_id == section_d_id
+    return location_id == section_l_id
+
+
+def __get_approval_logs(session, report_id, start_date, end_date, filters):
+    """
+    Get the most recent signed logs for each date, sensor, config, index combo
+
+    Returns:
+        list(tuple): (ApprovalLog dict +signer_name and reading, sensor location_id, sensor department_id)
+    """
+    return [
+        (
+            dict(
+                a._as_dict(),
+                signer_name=f"{first_name} {last_name}",
+                reading_when=reading_when,
+                reading_value=reading_value,
+                reading_id=r_id,
+            ),
+            location_id,
+            department_id,
+        )
+        for a, reading_when, reading_value, r_id, first_name, last_name, location_id, department_id in session.query(
+            ApprovalLog,
+            SensorData.created_when.label("reading_when"),
+            SensorData.sensor_value.label("reading_value"),
+            SensorData.id.label("reading_id"),
+            WebappUser.first_name,
+            WebappUser.last_name,
+            DeployedSensor.location_id,
+            DeployedSensor.department_id,
+        )
+        .distinct(
+            ApprovalLog.report_date,
+            ApprovalLog.sensor_id,
+            ApprovalLog.report_config_entry_index,
+            ApprovalLog.report_config_id,
+        )
+        .join(DeployedSensor, DeployedSensor.id == ApprovalLog.sensor_id)
+        .join(WebappUser, WebappUser.id == ApprovalLog.signer_id)
+        .outerjoin(SensorData, SensorData.id == ApprovalLog.reading_id)
+        .filter(
+            ApprovalLog.report_date >= start_date,
+            ApprovalLog.report_date <= end_date,
+            ApprovalLog.report_config_id == report_id,
+            *filters,
+        )
+        .order_by(
+            ApprovalLog.report_date,
+            ApprovalLog.sensor_id,
+            ApprovalLog.report_config_entry_index,
+            ApprovalLog.report_config_id,
+            ApprovalLog.signed_when.desc(),
+        )
+    ]
+
+
+def __get_report_filters(session, report_id, filters):
+    """Load a report's timing and add its sensor unit type restriction to filters
+
+    Returns:
+        tuple: (report_timing, filters), filters is None when the report has no unit types
+    """
+    report_timing, unit_type_id_list = (
+        session.query(ReportConfig.timing, ReportConfig.sensor_unit_type_ids)
+        .filter(ReportConfig.id == report_id)
+        .first()
+    )
+    if unit_type_id_list is None:
+        return report_timing, None
+    or_filter = []
+    for unit_type_id in unit_type_id_list:
+        or_filter.append(DeployedSensor.unit_type_id == unit_type_id)
+    return report_timing, list(filters) + [or_(*or_filter)]
+
+
 def __get_readings_timing(
     session, report_id, request_date, location_id=None, department_id=None, **kwargs
 ):
@@ -332,68 +543,118 @@ def __get_readings_timing(
     if department_id:
         filters.append(DeployedSensor.department_id == department_id)
 
-    report_timing, unit_type_id_list = (
-        session.query(ReportConfig.timing, ReportConfig.sensor_unit_type_ids)
-        .filter(ReportConfig.id == report_id)
-        .first()
-    )
+    report_timing, filters = __get_report_filters(session, report_id, filters)
     readings = []
-    or_filter = []
-    if unit_type_id_list is not None:
-        for unit_type_id in unit_type_id_list:
-            or_filter.append(DeployedSensor.unit_type_id == unit_type_id)
-        filters.append(or_(*or_filter))
+    if filters is not None:
+        readings = __get_readings_for_dates(
+            session,
+            filters,
+            {request_date: __get_check_windows(request_date, report_timing["checks"])},
+        ).get(request_date, [])
+
+    return dict(report_timing=report_timing, readings=readings)
+
+
+def __get_readings_for_dates(session, filters, windows_by_date):
+    """Evaluate every check of every date, fetching readings once per chunk of dates
+
+    At most REPORT_READINGS_CHUNK_DAYS dates of raw readings are held at a time, only
+    the selected check readings are kept across chunks.
+
+    Returns:
+        dict: request_date -> list of check readings with sensor_check_id
+    """
+    dates = [
+        request_date for request_date, windows in windows_by_date.items() if windows
+    ]
+    readings_by_date = {}
+    for i in range(0, len(dates), REPORT_READINGS_CHUNK_DAYS):
+        chunk = dates[i : i + REPORT_READINGS_CHUNK_DAYS]
+        readings_by_date.update(
+            __get_readings_for_chunk(
+                session,
+                filters,
+                {request_date: windows_by_date[request_date] for request_date in chunk},
+            )
+        )
+    return readings_by_date
 
-        for i, check in enumerate(report_timing["checks"]):
+
+def __get_readings_for_chunk(session, filters, windows_by_date):
+    """Evaluate every check of the given dates from a single readings fetch
+
+    Returns:
+        dict: request_date -> list of check readings with sensor_check_id
+    """
+    ranges = [
+        (min(w["start"] for w in windows), max(w["end"] for w in windows))
+        for windows in windows_by_date.values()
+    ]
+    sensors = __get_report_readings(session=session, filters=filters, ranges=ranges)
+    sensor_limits = __get_sensor_limits(sensors)
+    readings_by_date = {}
+    for request_date, windows in windows_by_date.items():
+        readings = []
+        for i, window in enumerate(windows):
             readings += [
                 dict(reading, sensor_check_id=i)
                 for reading in __get_check(
-                    session=session,
-                    filters=filters,
-                    start=request_date + " " + check["start_time"],
-                    end=request_date + " " + check["end_time"],
-                    sensor_check_id=i,
+                    by_sensor=__assign_readings_to_check(sensors, window),
+                    sensor_limits=sensor_limits,
+                    check_start_nominal=window["start_nominal"],
                 )
             ]
+        readings_by_date[request_date] = readings
+    return readings_by_date
 
-    return dict(report_timing=report_timing, readings=readings)
 
+def __get_check_windows(request_date, checks):
+    """Reading windows for each check of a report on request_date.
 
-def __get_check(session, filters, start, end, sensor_check_id):
-    """
-    list of objects
-                sensor_id
-                sensor_name
-                department_id,
-                location_id,
-                sensor_reading
-                sensor_unit,
-                sensor_check_id
-                created_when
+    Every check after the first also looks back 2 hours before its nominal start.
 
-    Args:
-        session (_type_): _description_
-        filters (_type_): _description_
-        start (_type_): _description_
-        end (_type_): _description_
+    Returns:
+        list(dict): start, end and start_nominal (naive local datetimes) per check index
     """
+    windows = []
+    for i, check in enumerate(checks):
+        start_nominal = datetime.datetime.strptime(
+            request_date + " " + check["start_time"], TIME_Q_STR_FORMAT
+        )
+        windows.append(
+            dict(
+                start=(
+                    start_nominal - datetime.timedelta(hours=2)
+                    if i > 0
+                    else start_nominal
+                ),
+                end=datetime.datetime.strptime(
+                    request_date + " " + check["end_time"], TIME_Q_STR_FORMAT
+                ),
+                start_nominal=start_nominal,
+            )
+        )
+    return windows
 
-    time_q_str_format = "%Y-%m-%d %H:%M:%S"
-    check_start = None
-    check_end = end
-    check_start_nominal = datetime.datetime.strptime(start, time_q_str_format)
-    if sensor_check_id > 0:
-        check_start_dt = check_start_nominal - datetime.timedelta(hours=2)
-        check_start = check_start_dt.strftime(time_q_str_format)
 
-    else:
-        check_start = start
+def __get_report_readings(session, filters, ranges):
+    """Fetch every active sensor's readings once for the union of all check windows
+
+    Args:
+        ranges (list(tuple)): (start, end) local datetimes, one per report date
 
+    Returns:
+        dict: sensor_id -> dict(
+            sensor: sensor columns with empty reading columns, used when a check has no readings
+            readings: reading rows ordered by local_created_when
+            times: offset naive local_created_when of each reading, for windowing
+        )
+    """
     # DATA TYPE comes from the sensors report type!
     check_filters = list(filters) + [
         DeployedSensor.active == True,
     ]
-    check_window_readings = (
+    window_readings = (
         session.query(
             DeployedSensor.name.label("sensor_name"),
             DeployedSensor.tag.label("category"),
@@ -414,8 +675,15 @@ def __get_check(session, filters, start, end, sensor_check_id):
             and_(
                 DeployedSensor.id == SensorData.sensor_id,
                 DeployedSensor.report_data_type == SensorData.data_type,
-                SensorData.local_created_when >= check_start,
-                SensorData.local_created_when <= check_end,
+                or_(
+                    *[
+                        and_(
+                            SensorData.local_created_when >= start,
+                            SensorData.local_created_when <= end,
+                        )
+                        for start, end in ranges
+                    ]
+                ),
             ),
         )
         .outerjoin(SensorUnitType, SensorUnitType.id == DeployedSensor.unit_type_id)
@@ -424,106 +692,146 @@ def __get_check(session, filters, start, end, sensor_check_id):
         )
         .order_by(DeployedSensor.id, SensorData.local_created_when.asc())
     )
+
+    sensors = {}
+    for row in window_readings:
+        reading = dict(row)
+        if row.sensor_id not in sensors:
+            sensors[row.sensor_id] = dict(
+                sensor=dict(
+                    reading,
+                    **{k: None for k in __READING_COLUMNS},
+                ),
+                readings=[],
+                times=[],
+            )
+        if row.local_created_when is not None:
+            sensors[row.sensor_id]["readings"].append(reading)
+            sensors[row.sensor_id]["times"].append(
+                row.local_created_when.replace(tzinfo=None)
+            )
+    return sensors
+
+
+def __assign_readings_to_check(sensors, window):
+    """Slice each sensor's time ordered readings down to a single check window
+
+    A sensor without readings in the window gets its empty reading row, matching the
+    outer join behaviour of a per check query.
+
+    Returns:
+        dict: sensor_id -> list of reading dicts for the check
+    """
     by_sensor = {}
+    for sensor_id, sensor in sensors.items():
+        lo = bisect_left(sensor["times"], window["start"])
+        hi = bisect_right(sensor["times"], window["end"])
+        check_readings = sensor["readings"][lo:hi] or [sensor["sensor"]]
+        by_sensor[sensor_id] = [
+            dict(reading, out_of_range=False) for reading in check_readings
+        ]
+    return by_sensor
+
+
+def __get_check(by_sensor, sensor_limits, check_start_nominal):
+    """
+    list of objects
+                sensor_id
+                sensor_name
+                department_id,
+                location_id,
+                sensor_reading
+                sensor_unit,
+                sensor_check_id
+                created_when
 
+    Args:
+        by_sensor (dict): sensor_id -> readings within the check window, ordered by time
+        sensor_limits (dict): sensor_id -> high temp limit (C) or None, see __get_sensor_limits
+        check_start_nominal (datetime): configured start of the check, without the look back
+    """
     ret = {}
-    for row in check_window_readings:
-        if row.sensor_id in by_sensor:
-            by_sensor[row.sensor_id].append(dict(row, out_of_range=False))
-        else:
-            by_sensor[row.sensor_id] = [dict(row, out_of_range=False)]
+    for sensor_id, check_readings in by_sensor.items():
+        if not check_readings:
+            continue
+        # TECH DEBT: As it stands, no lower limits are ever set for A3
+        temp_limit = sensor_limits.get(sensor_id)
+        if temp_limit is None:
+            ret[sensor_id] = check_readings[-1]
+            continue
 
-    for sensor_id in by_sensor:
         oor_start = None
-        end_dt = None
-        oor_interval_found = False
         last_oor_interval_reading = None
         last_ir_reading = None
         last_oor_reading = None
-        n_readings = len(by_sensor[sensor_id])
-        if n_readings > 0:
-            for check_reading in by_sensor[sensor_id]:
-                most_recent_reading = check_reading
-                try:
-                    sensor_category = check_reading["unit_type"].lower()
-                except Exception as e:
-                    logger.error(
-                        f"No unit type for A3 for sensor_id {sensor_id} reading {check_reading}: {e}"
-                    )
-                limits = check_unit_type_has_limits(sensor_category)
-                if limits.get("high", None) is not None:
-                    # TECH DEBT: As it stands, no lower limits are ever set for A3
-                    temp_limit = limits.get("high", None)
-                    current_reading = check_reading["sensor_reading"]
-                    if current_reading is not None and current_reading > temp_limit:
-                        last_oor_reading = check_reading
-                        oor_start = (
-                            last_oor_reading["local_created_when"]
-                            if oor_start is None
-                            else oor_start
-                        )
-                        start_dt = oor_start
-                        end_dt = last_oor_reading["local_created_when"]
-                        oor_interval = end_dt - start_dt
-                        if oor_interval >= datetime.timedelta(hours=2):
-                            oor_interval_found = True
-                            last_oor_interval_reading = last_oor_reading
-                    else:
-                        oor_start = None
-                        end_dt = None
-                        last_ir_reading = check_reading
-
-                    # Determine
-                    non_alert_reading_to_use = use_in_range_or_out_of_range(
-                        last_ir_reading,
-                        last_oor_reading,
-                        time_q_str_format,
-                        check_start_nominal,
-                    )
-                    if oor_interval_found and last_oor_interval_reading:
-                        offset_naive_lcw_str = datetime.datetime.strftime(
-                            last_oor_interval_reading["local_created_when"],
-                            time_q_str_format,
-                        )
-                        offset_naive_lcw = datetime.datetime.strptime(
-                            offset_naive_lcw_str, time_q_str_format
-                        )
-                        if offset_naive_lcw >= check_start_nominal:
-                            last_oor_interval_reading["out_of_range"] = True
-                            ret[sensor_id] = last_oor_interval_reading
-                        elif non_alert_reading_to_use is not None:
-                            ret[sensor_id] = non_alert_reading_to_use
-                    elif non_alert_reading_to_use is not None:
-                        ret[sensor_id] = non_alert_reading_to_use
-                    else:
-                        ret[sensor_id] = check_reading
-                else:
-                    ret[sensor_id] = most_recent_reading
+        # Reported when nothing is eligible, the last reading before an OOR interval was found
+        fallback_reading = None
+        for check_reading in check_readings:
+            current_reading = check_reading["sensor_reading"]
+            if current_reading is not None and current_reading > temp_limit:
+                last_oor_reading = check_reading
+                if oor_start is None:
+                    oor_start = check_reading["local_created_when"]
+                if check_reading["local_created_when"] - oor_start >= OOR_INTERVAL:
+                    last_oor_interval_reading = check_reading
+                    if reading_eligible_for_check(check_reading, check_start_nominal):
+                        # Flagged as soon as it ends an eligible interval, even when a
+                        # later reading ends up reported
+                        check_reading["out_of_range"] = True
+            else:
+                oor_start = None
+                last_ir_reading = check_reading
+            if last_oor_interval_reading is None:
+                fallback_reading = check_reading
+
+        non_alert_reading_to_use = use_in_range_or_out_of_range(
+            last_ir_reading, last_oor_reading, check_start_nominal
+        )
+        if last_oor_interval_reading is not None and reading_eligible_for_check(
+            last_oor_interval_reading, check_start_nominal
+        ):
+            ret[sensor_id] = last_oor_interval_reading
+        elif non_alert_reading_to_use is not None:
+            ret[sensor_id] = non_alert_reading_to_use
+        else:
+            ret[sensor_id] = fallback_reading
 
     return ret.values()
 
 
-def reading_eligible_for_check(reading, time_format, check_start):
+def __get_sensor_limits(sensors):
+    """Resolve each sensor's A3 high temp limit once from its unit type
+
+    Returns:
+        dict: sensor_id -> high limit in C, None when the unit type has no limits
+    """
+    limits_by_unit_type = {}
+    sensor_limits = {}
+    for sensor_id, sensor in sensors.items():
+        unit_type = sensor["sensor"]["unit_type"]
+        if unit_type is None:
+            logger.error(f"No unit type for A3 for sensor_id {sensor_id}")
+        if unit_type not in limits_by_unit_type:
+            limits_by_unit_type[unit_type] = check_unit_type_has_limits(unit_type).get(
+                "high", None
+            )
+        sensor_limits[sensor_id] = limits_by_unit_type[unit_type]
+    return sensor_limits
+
+
+def reading_eligible_for_check(reading, check_start):
     if reading["local_created_when"] is None:
         return False
     # Have to make it offset naive
-    offset_naive_reading_dt_str = datetime.datetime.strftime(
-        reading["local_created_when"], time_format
-    )
-
-    offset_naive_reading_dt = datetime.datetime.strptime(
-        offset_naive_reading_dt_str, time_format
-    )
-
-    return True if offset_naive_reading_dt >= check_start else False
+    return reading["local_created_when"].replace(tzinfo=None) >= check_start
 
 
-def use_in_range_or_out_of_range(in_range, out_of_range, time_format, check_start):
+def use_in_range_or_out_of_range(in_range, out_of_range, check_start):
     in_range_eligible = in_range is not None and reading_eligible_for_check(
-        in_range, time_format, check_start
+        in_range, check_start
     )
     out_of_range_eligible = out_of_range is not None and reading_eligible_for_check(
-        out_of_range, time_format, check_start
+        out_of_range, check_start
     )
     return (
         in_range
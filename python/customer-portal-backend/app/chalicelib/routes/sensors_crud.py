@@ -14,8 +14,9 @@ from backendlib.utils import parse_and_decamlize_params
 from backendlib.utils import extract_filter_primary_key_and_vals
 from backendlib.sessionmanager import get_session, render_query
 from sqlalchemy import func, or_, and_
-from backendlib.utils import format_as_java_time, json_zip
-from backendlib.helpers.casing_converter import camelize
+from backendlib.utils import format_as_java_time
+from chalicelib.instrumentation import json_zip, camelize
+from chalicelib.services import LocationService
 from backendlib.utils import decamelize
 from backendlib.helpers.defaulter_dict import DefaultingDictList
 from backendlib.helpers.android_lambda_helper import request_android_config
@@ -44,8 +45,12 @@ from chalicelib.services.logging.DataInteractionLoggerService import (
     DataInteractionLoggerService,
 )
 from chalicelib.services.logging.utils import INTERACTION_TYPE, create_log_obj_short
-from csv import DictWriter
-import io
+from chalicelib.services.ExportService import EXPORT_BATCH_SIZE, GzipCsvExport
+from chalicelib.batching import batched
+from chalicelib.services.UserLookupService import (
+    UserLookupService,
+    sensor_action_user_ids,
+)
 from sqlalchemy.orm import aliased
 
 bp_sensors = Blueprint(__name__)
@@ -149,41 +154,32 @@ def get_permissions():
     )
 
     with get_session() as session:
-        q = (
-            session.query(
-                Location.name.label("location_name"),
-                Location.id,
-                Department.id.label("department_id"),
-                Department.name.label("department_name"),
-                DeployedSensor.tag,
-            )
-            .outerjoin(Department, Department.location_id == Location.id)
-            .outerjoin(DeployedSensor, DeployedSensor.location_id == Location.id)
-            .filter(Location.id.in_(all_lids))
+        # Locations, departments and tags are loaded separately, joining departments
+        # and sensors to the location returned departments x sensors rows
+        location_names = dict(
+            session.query(Location.id, Location.name).filter(Location.id.in_(all_lids))
         )
-
-        for row in q:
-            if row.tag and isinstance(row.tag, list):
-                for tag in row.tag:
-                    if tag:
-                        ret["available_tags"][tag] = {"value": tag, "label": tag}
-
-            for perm_name in [
-                "view_sensors_and_actions",
-                "edit_sensors",
-                "edit_actions",
-            ]:
-                if row.id in ret[perm_name]:
-                    to_update = ret[perm_name][row.id]
-                    to_update["label"] = row.location_name
-
-                    if row.department_id:
-                        department_entry = {
-                            "value": row.department_id,
-                            "label": row.department_name,
-                        }
-                        if department_entry not in to_update["departments"]:
-                            to_update["departments"].append(department_entry)
+        departments = LocationService.get_departments_by_location(session, all_lids)
+        tag_column = func.unnest(DeployedSensor.tag).label("tag")
+        tags = (
+            session.query(tag_column)
+            .filter(DeployedSensor.location_id.in_(all_lids))
+            .distinct()
+            .order_by(tag_column)
+        )
+        for (tag,) in tags:
+            if tag:
+                ret["available_tags"][tag] = {"value": tag, "label": tag}
+
+    for perm_name in ["view_sensors_and_actions", "edit_sensors", "edit_actions"]:
+        for location_id, to_update in ret[perm_name].items():
+            if location_id not in location_names:
+                continue
+            to_update["label"] = location_names[location_id]
+            to_update["departments"] = [
+                {"value": department_id, "label": department_name}
+                for department_id, department_name in departments.get(location_id, [])
+            ]
 
     ret["available_tags"] = list(ret["available_tags"].values())
 
@@ -319,16 +315,6 @@ def get_sensor(sensor_id):
         raise BadRequestError("Invalid request")
 
     with get_session() as session:
-        users = {
-            t.id: t
-            for t in session.query(
-                WebappUser.id,
-                WebappUser.first_name,
-                WebappUser.last_name,
-                WebappUser.email,
-                WebappUser.phone_number,
-            )
-        }
         q = (
             session.query(
                 DeployedSensor,
@@ -353,8 +339,13 @@ def get_sensor(sensor_id):
                 DeployedSensor.location_id.in_(l_ids), DeployedSensor.id == sensor_id
             )
         )
+        rows = q.all()
+        user_ids = set()
+        for row in rows:
+            user_ids.update(sensor_action_user_ids(row.SensorAction))
+        users = UserLookupService(session).resolve(user_ids)
         response = {}
-        for ds, sa, sm, dep_name, loc_name, unit_type_name in q:
+        for ds, sa, sm, dep_name, loc_name, unit_type_name in rows:
             entry = response.get(
                 ds.id,
                 dict(
@@ -907,6 +898,37 @@ def get_users(location_id):
         return dict(data=json_zip(camelize([dict(r) for r in q])))
 
 
+EXPORT_USER_COLUMNS = {
+    "Emails To": "email",
+    "Emails CC": "email",
+    "Emails BCC": "email",
+    "SMS #": "phone_number",
+}
+
+
+def __format_export_row(row, users):
+    to_add = dict(row)
+    for key, user_field in EXPORT_USER_COLUMNS.items():
+        to_add[key] = (
+            "; ".join(
+                [
+                    getattr(users[u_id], user_field) or ""
+                    for u_id in to_add[key]
+                    if u_id in users
+                ]
+            )
+            if to_add[key]
+            else None
+        )
+    to_add["Alert Suppression"] = (
+        f"{to_add['Alert Suppression']}" if to_add["Alert Suppression"] else None
+    )
+    to_add["Alert Recurrence"] = (
+        f"{to_add['Alert Recurrence']}" if to_add["Alert Recurrence"] else None
+    )
+    return to_add
+
+
 @bp_sensors.route("/sensors/export", methods=["GET"], authorizer=auth)
 def export_sensors():
     """Generates a CSV file on the backend for exporting all Sensors and Actions
@@ -917,13 +939,21 @@ def export_sensors():
     All user_ids are converted to Emails/phone numbers for rendering.
     Sensor actions are inflated out per sensor.
 
+    Rows are streamed from the database in batches and written straight into a
+    gzipped CSV on disk. Small exports are returned inline, large ones (more than
+    EXPORT_INLINE_ROW_LIMIT rows, or when ?download=true is passed) are uploaded
+    and returned as a download url. Without an EXPORT_BUCKET every export is inline.
+
     Raises:
         BadRequestError: On invalid permissions or no sensors
     Returns:
         dict: data=b64zipped(dict(csv_file=file_contents))
+              or data=b64zipped(dict(download_url=url, row_count=n)) for large exports
     """
     __log_interaction(dict(), INTERACTION_TYPE.FETCH_SENSORS)
     user_id = get_authorized_user_id(bp_sensors.current_request)
+    query_params = bp_sensors.current_request.query_params or {}
+    force_download = query_params.get("download", "").lower() in ["true", "1", "yes"]
     l_ids = get_approved_permissions_per_level(
         user_id=user_id,
         required_permissions=["view_sensors_and_actions"],
@@ -933,13 +963,7 @@ def export_sensors():
         raise BadRequestError(
             "User doesn't have permission to access sensors on any location"
         )
-    with get_session() as session:
-        all_users = {
-            u.id: dict(u)
-            for u in session.query(
-                WebappUser.id, WebappUser.email, WebappUser.phone_number
-            )
-        }
+    with get_session() as session, GzipCsvExport("sensors") as export:
         q = (
             session.query(
                 DeployedSensor.public_addr.label("Sensor ID"),
@@ -967,63 +991,26 @@ def export_sensors():
             .filter(
                 DeployedSensor.location_id.in_(l_ids), DeployedSensor.active == True
             )
+            .yield_per(EXPORT_BATCH_SIZE)
         )
 
-        response = []
-        for row in q:
-            to_add = dict(row)
-            to_add["Emails To"] = (
-                (
-                    "; ".join(
-                        [all_users[u_id]["email"] for u_id in to_add["Emails To"]]
-                    )
-                    if to_add["Emails To"]
-                    else None
-                ),
-            )
-            to_add["Emails CC"] = (
-                (
-                    "; ".join(
-                        [all_users[u_id]["email"] for u_id in to_add["Emails CC"]]
-                    )
-                    if to_add["Emails CC"]
-                    else None
-                ),
-            )
-            to_add["Emails BCC"] = (
-                (
-                    "; ".join(
-                        [all_users[u_id]["email"] for u_id in to_add["Emails BCC"]]
-                    )
-                    if to_add["Emails BCC"]
-                    else None
-                ),
-            )
-            to_add["SMS #"] = (
-                (
-                    "; ".join([all_users[u_id]["email"] for u_id in to_add["SMS #"]])
-                    if to_add["SMS #"]
-                    else None
-                ),
-            )
-            to_add["Alert Suppression"] = (
-                f"{to_add['Alert Suppression']}"
-                if to_add["Alert Suppression"]
-                else None
-            )
-            to_add["Alert Recurrence"] = (
-                f"{to_add['Alert Recurrence']}" if to_add["Alert Recurrence"] else None
-            )
-            response.append(to_add)
-    if not response:
+        user_lookup = UserLookupService(session)
+        for rows in batched(q, EXPORT_BATCH_SIZE):
+            user_ids = set()
+            for row in rows:
+                for key in EXPORT_USER_COLUMNS:
+                    user_ids.update(row[key] or [])
+            users = user_lookup.resolve(user_ids)
+            export.write_rows(__format_export_row(row, users) for row in rows)
+
+    if not export.row_count:
+        export.cleanup()
         raise BadRequestError("No Sensors found")
 
-    with io.StringIO() as in_memory_file:
-        output = DictWriter(in_memory_file, fieldnames=list(response[0].keys()))
-        output.writeheader()
-        output.writerows(response)
-        in_memory_file.flush()
-        in_memory_file.seek(0)
-        return dict(data=json_zip(dict(csv_file=in_memory_file.read())))
-
-        # Need to do a CSVDictWriter and an in memory file that we base64 and send.
+    if export.should_publish(force=force_download):
+        return dict(
+            data=json_zip(
+                dict(download_url=export.publish(), row_count=export.row_count)
+            )
+        )
+    return dict(data=json_zip(dict(csv_file=export.read_text())))
@@ -5,6 +5,7 @@ import leangle
 from chalicelib.services.logging.DataInteractionLoggerService import DataInteractionLoggerService
 from chalicelib.services.logging.utils import INTERACTION_TYPE
 from datetime import datetime
+import io
 from backendlib.models import WebappDataInteraction
 
 bp_upload = Blueprint(__name__)
@@ -77,3 +78,34 @@ def bulk_upload():
         DataInteractionLoggerService.log(log_obj, admin_pw_flag)
 
     return Response(body=final_result, status_code=final_status_code)
+
+
+@bp_upload.route('/bulk-upload/csv', methods=['POST'], authorizer=auth, content_types=['text/csv'])
+@leangle.describe.response(200, description='Import employees from a CSV file', schema='UserListResponseSchema')
+def bulk_upload_csv():
+    """Same as /bulk-upload but takes the raw CSV file as the body, locationId as a query param"""
+    query_params = bp_upload.current_request.query_params or {}
+    if 'locationId' not in query_params:
+        raise BadRequestError("Incorrect upload location")
+    loc_id = query_params['locationId']
+    user_id = current_user_id()
+    admin_pw_flag = current_admin_pw_flag()
+
+    user_agent, source_ip = get_agent_data(bp_upload.current_request)
+    log_obj = create_log_obj(INTERACTION_TYPE.IMPORT_EMPLOYEES, user_id, user_agent, source_ip)
+
+    has_permissions = PermissionService.check_lgb_perms_based_on_l_ids(user_id, ['upload_employees'], [loc_id])
+
+    if not has_permissions:
+        raise ForbiddenError("The user does not have required permissions to perform this action")
+
+    body = io.TextIOWrapper(io.BytesIO(bp_upload.current_request.raw_body), encoding='utf-8-sig', newline='')
+    is_success, msg = LocationService.bulk_upload_employees(loc_id, LocationService.parse_employee_csv(body))
+
+    final_result = {'data': msg}
+    final_status_code = 200 if is_success else 409
+
+    if is_success:
+        DataInteractionLoggerService.log(log_obj, admin_pw_flag)
+
+    return Response(body=final_result, status_code=final_status_code)
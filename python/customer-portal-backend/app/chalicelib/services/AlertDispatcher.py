@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backendlib.secretsmanager import get_sendgrid_api_key
+from sendgrid import SendGridAPIClient
+
+from chalicelib.services.EmailHelper import send_template_based_email
+from chalicelib.services.SMSService import send_sms
+
+ALERT_MAX_WORKERS = int(os.environ.get("ALERT_MAX_WORKERS", 8))
+ALERT_SMS_PER_SECOND = float(os.environ.get("ALERT_SMS_PER_SECOND", 5))
+ALERT_EMAIL_PER_SECOND = float(os.environ.get("ALERT_EMAIL_PER_SECOND", 10))
+
+__SG_CLIENT = None
+__SG_CLIENT_LOCK = threading.Lock()
+
+
+def _sendgrid_client():
+    global __SG_CLIENT
+    with __SG_CLIENT_LOCK:
+        if __SG_CLIENT is None:
+            __SG_CLIENT = SendGridAPIClient(get_sendgrid_api_key())
+    return __SG_CLIENT
+
+
+def _send_email(**kwargs):
+    """send_template_based_email with the shared SendGrid client
+
+    The client, and the API key secret behind it, is resolved here on the delivery
+    thread so a Secrets Manager failure is logged like any other failed delivery.
+    """
+    return send_template_based_email(sg_client=_sendgrid_client(), **kwargs)
+
+
+class RateLimiter(object):
+    """Spaces calls out so at most rate_per_second of them start each second, thread safe"""
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AlertDispatcher(object):
+    """Collects alert SMS and emails and delivers them concurrently.
+
+    Deliveries run on a bounded thread pool, each channel has its own rate limit so
+    a large fan-out stays within the Dialpad and SendGrid API limits. A failed
+    delivery is logged and does not stop the others.
+
+    Usage:
+        dispatcher = AlertDispatcher()
+        dispatcher.add_sms(phone_numbers, message)
+        dispatcher.add_email(template_id=..., ...)
+        dispatcher.dispatch()
+    """
+
+    def __init__(self, max_workers=ALERT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._jobs = []
+        self._limits = {
+            "sms": RateLimiter(ALERT_SMS_PER_SECOND),
+            "email": RateLimiter(ALERT_EMAIL_PER_SECOND),
+        }
+
+    def add_sms(self, phone_numbers, message):
+        # One job per number so numbers are sent in parallel
+        for phone_number in phone_numbers:
+            self._jobs.append(
+                ("sms", send_sms, dict(phone_numbers=[phone_number], message=message))
+            )
+
+    def add_email(self, **kwargs):
+        """Queue a send_template_based_email call, sent with the shared SendGrid client"""
+        self._jobs.append(("email", _send_email, kwargs))
+
+    def _run(self, channel, send, kwargs):
+        self._limits[channel].acquire()
+        try:
+            return send(**kwargs)
+        except Exception as e:
+            logging.exception(f"Failed to deliver {channel} alert - {e}")
+
+    def dispatch(self):
+        """Deliver every queued alert and wait for them to finish
+
+        Returns:
+            int: number of deliveries attempted
+        """
+        jobs, self._jobs = self._jobs, []
+        if not jobs:
+            return 0
+        workers = min(self.max_workers, len(jobs))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda job: self._run(*job), jobs))
+        return len(jobs)
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from chalicelib.services.AlertDispatcher import AlertDispatcher
+
+# Longest time a buffered alert waits inside a coalesced_alerts block before it is sent
+# early, checked whenever another alert is buffered
+ALERT_COALESCE_SECONDS = float(os.environ.get("ALERT_COALESCE_SECONDS", 30))
+# Dialpad rejects messages of 1500 characters or more, see SMSService.send_sms
+SMS_DIGEST_MAX_LENGTH = 1499
+SMS_DIGEST_SEPARATOR = "\n\n"
+
+
+class AlertDeliveryQueue(object):
+    """Buffers outgoing alerts and sends digests keyed by recipient.
+
+    SMS messages are deduplicated per phone number and the distinct messages for a
+    number are joined into as few texts as the SMS length limit allows. Emails are
+    template based without per alert data, so identical emails (same template and
+    same to, cc and bcc recipients) are sent once per flush. Emails addressed to
+    different recipients are never merged, a recipient only sees the addresses their
+    own report already lists.
+    """
+
+    def __init__(self, window_seconds=ALERT_COALESCE_SECONDS):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._sms = {}
+        self._emails = {}
+        self._oldest = None
+
+    def _touch(self):
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def add_sms(self, phone_numbers, message):
+        with self._lock:
+            for phone_number in phone_numbers:
+                # dict keeps insertion order and drops repeated messages
+                self._sms.setdefault(phone_number, {})[message] = None
+            self._touch()
+
+    def add_email(
+        self, template_id, from_email, to_emails, category, cc_emails=[], bcc_emails=[]
+    ):
+        # Same header precedence as send_template_based_email
+        to_emails = frozenset(to_emails)
+        cc_emails = frozenset(cc_emails) - to_emails
+        bcc_emails = frozenset(bcc_emails) - cc_emails - to_emails
+        if not to_emails:
+            # Matches send_alert, an email is only sent with a to address
+            return
+        with self._lock:
+            key = (template_id, from_email, category, to_emails, cc_emails, bcc_emails)
+            self._emails[key] = None
+            self._touch()
+
+    def pending(self):
+        with self._lock:
+            return len(self._sms) + len(self._emails)
+
+    def due(self):
+        with self._lock:
+            return (
+                self._oldest is not None
+                and time.monotonic() - self._oldest >= self.window_seconds
+            )
+
+    def flush(self, dispatcher=None):
+        """Send every buffered alert as digests
+
+        Returns:
+            int: number of deliveries attempted
+        """
+        with self._lock:
+            sms, self._sms = self._sms, {}
+            emails, self._emails = self._emails, {}
+            self._oldest = None
+        dispatcher = dispatcher or AlertDispatcher()
+        for phone_number, messages in sms.items():
+            for digest in _sms_digests(list(messages)):
+                dispatcher.add_sms(phone_numbers=[phone_number], message=digest)
+        for (
+            template_id,
+            from_email,
+            category,
+            to_emails,
+            cc_emails,
+            bcc_emails,
+        ) in emails:
+            dispatcher.add_email(
+                template_id=template_id,
+                from_email=from_email,
+                to_emails=sorted(to_emails),
+                cc_emails=sorted(cc_emails),
+                bcc_emails=sorted(bcc_emails),
+                category=category,
+            )
+        return dispatcher.dispatch()
+
+
+def _sms_digests(messages):
+    """Join messages into as few texts as possible under SMS_DIGEST_MAX_LENGTH"""
+    digests = []
+    current = ""
+    for message in messages:
+        candidate = f"{current}{SMS_DIGEST_SEPARATOR}{message}" if current else message
+        if len(candidate) <= SMS_DIGEST_MAX_LENGTH or not current:
+            current = candidate
+        else:
+            digests.append(current)
+            current = message
+    if current:
+        digests.append(current)
+    return digests
+
+
+_current_queue = ContextVar("alert_queue", default=None)
+
+
+@contextmanager
+def coalesced_alerts():
+    """Buffer alerts sent inside the block and deliver them as digests
+
+    The outermost block owns a queue and flushes it when it exits, nested blocks share
+    it. app.py wraps every invocation in a block so buffered alerts are always
+    delivered before the invocation ends. Alerts can go out earlier once the oldest
+    buffered alert has waited ALERT_COALESCE_SECONDS, see send_alert.
+
+    Usage:
+        with coalesced_alerts() as queue:
+            queue.add_sms(phone_numbers, message)
+    """
+    queue = _current_queue.get()
+    if queue is not None:
+        yield queue
+        return
+    queue = AlertDeliveryQueue()
+    token = _current_queue.set(queue)
+    try:
+        yield queue
+    finally:
+        _current_queue.reset(token)
+        queue.flush()
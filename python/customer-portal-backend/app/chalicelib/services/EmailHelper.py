@@ -0,0 +1,51 @@
+from sendgrid import SendGridAPIClient
+from sendgrid.helpers.mail import Category, Mail
+from backendlib.secretsmanager import get_sendgrid_api_key
+import logging
+
+
+def send_template_based_email(
+    template_id,
+    from_email,
+    to_emails,
+    category,
+    subject="",
+    preheader="",
+    email_data={},
+    cc_emails=[],
+    bcc_emails=[],
+    sg_client=None,
+):
+    """EmailService.send_template_based_email with an injectable SendGrid client
+
+    TODO: delete this copy once backendlib's EmailService.send_template_based_email
+    takes an sg_client argument, until then keep the two in sync.
+
+    Args:
+        sg_client (SendGridAPIClient): client to send with, a new one is created when None
+    """
+    to_emails = set(to_emails)
+    cc_emails = set(cc_emails) - to_emails
+    bcc_emails = (set(bcc_emails) - cc_emails) - to_emails
+    message = Mail(from_email=from_email, to_emails=list(to_emails))
+    for t in cc_emails:
+        message.add_cc(t)
+    for t in bcc_emails:
+        message.add_bcc(t)
+    message.template_id = template_id
+    message.add_category(Category(category))
+    subjects = {"subject": subject, "preheader": preheader}
+    final_email_data = {**subjects, **email_data}
+    message.dynamic_template_data = final_email_data
+
+    sg = sg_client or SendGridAPIClient(get_sendgrid_api_key())
+    response = sg.send(message)
+
+    # Recipient addresses are left out of the logs
+    n_recipients = len(to_emails) + len(cc_emails) + len(bcc_emails)
+    logging.info(f"Sending: template {template_id} to {n_recipients} recipients")
+
+    final_response = (
+        "success" if response.status_code == 202 else f"error: {response.status_code}"
+    )
+    return final_response
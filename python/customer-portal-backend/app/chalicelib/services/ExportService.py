@@ -0,0 +1,112 @@
+import gzip
+import os
+import tempfile
+import uuid
+from csv import DictWriter
+
+import boto3
+
+# Exports are only published when a bucket is configured, otherwise returned inline
+EXPORT_BUCKET = os.environ.get("EXPORT_BUCKET")
+EXPORT_URL_TTL_SECONDS = int(os.environ.get("EXPORT_URL_TTL_SECONDS", 3600))
+# Exports with more rows than this are returned as a download url instead of inline
+EXPORT_INLINE_ROW_LIMIT = int(os.environ.get("EXPORT_INLINE_ROW_LIMIT", 5000))
+EXPORT_BATCH_SIZE = 1000
+
+__S3_CLIENT = None
+
+
+def _s3_client():
+    global __S3_CLIENT
+    if __S3_CLIENT is None:
+        __S3_CLIENT = boto3.client("s3")
+    return __S3_CLIENT
+
+
+class GzipCsvExport(object):
+    """CSV writer that streams rows straight into a gzip file on local disk.
+
+    The header is taken from the keys of the first row written. Once finished the
+    file is either read back inline or, when EXPORT_BUCKET is configured,
+    published to S3 for a download url.
+
+    Usage:
+        with GzipCsvExport("sensors") as export:
+            export.write_rows(rows)
+        if export.should_publish():
+            url = export.publish()
+        else:
+            csv_file = export.read_text()
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.file_name = f"{name}-{uuid.uuid4()}.csv.gz"
+        self.path = os.path.join(tempfile.gettempdir(), self.file_name)
+        self.row_count = 0
+        self._file = None
+        self._writer = None
+
+    def __enter__(self):
+        self._file = gzip.open(self.path, "wt", newline="")
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self._file.close()
+        if exc_type is not None:
+            self.cleanup()
+        return False
+
+    def write_rows(self, rows):
+        for row in rows:
+            if self._writer is None:
+                self._writer = DictWriter(self._file, fieldnames=list(row.keys()))
+                self._writer.writeheader()
+            self._writer.writerow(row)
+            self.row_count += 1
+
+    def read_text(self):
+        with gzip.open(self.path, "rt", newline="") as f:
+            contents = f.read()
+        self.cleanup()
+        return contents
+
+    def should_publish(self, force=False):
+        """True when the export goes to S3 instead of inline, never without EXPORT_BUCKET"""
+        return bool(EXPORT_BUCKET) and (
+            force or self.row_count > EXPORT_INLINE_ROW_LIMIT
+        )
+
+    def publish(self, key_prefix="exports"):
+        """Upload the finished export and return a url to download it from
+
+        Returns:
+            str: presigned S3 url
+        """
+        if not EXPORT_BUCKET:
+            self.cleanup()
+            raise RuntimeError("EXPORT_BUCKET is not configured")
+        key = f"{key_prefix}/{self.file_name}"
+        client = _s3_client()
+        client.upload_file(
+            self.path,
+            EXPORT_BUCKET,
+            key,
+            ExtraArgs={
+                "ContentType": "text/csv",
+                "ContentEncoding": "gzip",
+                "ContentDisposition": f'attachment; filename="{self.name}.csv"',
+            },
+        )
+        self.cleanup()
+        return client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": EXPORT_BUCKET, "Key": key},
+            ExpiresIn=EXPORT_URL_TTL_SECONDS,
+        )
+
+    def cleanup(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
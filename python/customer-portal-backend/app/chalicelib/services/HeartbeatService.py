@@ -0,0 +1,71 @@
+import datetime
+from typing import NamedTuple, Optional
+
+from backendlib.models import DeviceStatus, DeviceStatusMostRecent, Station
+
+
+class StationHeartbeat(NamedTuple):
+    station_id: int
+    location_id: int
+    # UTC, None when the station never reported a status
+    last_ping_utc: Optional[datetime.datetime]
+
+
+def _as_utc(value):
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def get_station_heartbeats(session, location_ids):
+    """Last ping of every active station of the locations, read in one query
+
+    Offline checks over many locations and dates share the result instead of joining
+    Station -> DeviceStatus per location or per date.
+
+    Returns:
+        dict: location_id -> tuple of StationHeartbeat, empty for locations without active stations
+    """
+    heartbeats = {location_id: [] for location_id in location_ids}
+    if not heartbeats:
+        return {}
+    q = (
+        session.query(
+            Station.id,
+            Station.location_id,
+            DeviceStatus.status_when,
+        )
+        .outerjoin(
+            DeviceStatusMostRecent,
+            DeviceStatusMostRecent.station_id == Station.id,
+        )
+        .outerjoin(
+            DeviceStatus,
+            DeviceStatus.id == DeviceStatusMostRecent.device_status_id,
+        )
+        .filter(Station.location_id.in_(list(heartbeats)), Station.active == True)
+    )
+    for station_id, location_id, status_when in q:
+        heartbeats[location_id].append(
+            StationHeartbeat(station_id, location_id, _as_utc(status_when))
+        )
+    return {
+        location_id: tuple(stations) for location_id, stations in heartbeats.items()
+    }
+
+
+def stations_not_pinged_after(heartbeats, after_utc):
+    """Stations whose last ping is not after after_utc, stations that never pinged included
+
+    Args:
+        heartbeats (iterable): StationHeartbeat of one or more locations
+        after_utc (datetime): offset aware UTC time
+
+    Returns:
+        list: the matching StationHeartbeat
+    """
+    return [
+        heartbeat
+        for heartbeat in heartbeats
+        if heartbeat.last_ping_utc is None or heartbeat.last_ping_utc <= after_utc
+    ]
@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, NamedTuple, Optional, Tuple
+
+from backendlib.models import Location, VendorLocationMapping
+from sqlalchemy import and_
+
+from chalicelib.services.GoalService import get_open_close_dicts
+
+
+class LocationMeta(NamedTuple):
+    location_id: int
+    name: str
+    timezone: Optional[str]
+    scan_goal: Optional[int]
+    detailed_scan_goal: Any
+    # Active VendorLocationMapping ids, oldest mapping first
+    dfs_vendor_location_ids: Tuple[str, ...]
+
+
+class LocationMetadataLoader(object):
+    """Location metadata fetched in bulk and kept for the lifetime of a request
+
+    Every location is read at most once per loader, however many helpers and dates
+    ask for it. Not thread safe, a loader belongs to a single request.
+    """
+
+    def __init__(self):
+        self._locations = {}
+        self._open_close = {}
+
+    def locations(self, session, location_ids):
+        """
+        Returns:
+            dict: location_id -> LocationMeta, locations that do not exist are left out
+        """
+        missing = [
+            location_id
+            for location_id in set(location_ids)
+            if location_id not in self._locations
+        ]
+        if missing:
+            loaded = {location_id: None for location_id in missing}
+            q = (
+                session.query(
+                    Location.id,
+                    Location.name,
+                    Location.timezone,
+                    Location.scan_goal,
+                    Location.detailed_scan_goal,
+                    VendorLocationMapping.dfs_vendor_location_id,
+                )
+                .outerjoin(
+                    VendorLocationMapping,
+                    and_(
+                        VendorLocationMapping.location_id == Location.id,
+                        VendorLocationMapping.active == True,
+                    ),
+                )
+                .filter(Location.id.in_(missing))
+                .order_by(Location.id, VendorLocationMapping.id)
+            )
+            for row in q:
+                location = loaded[row.id]
+                if location is None:
+                    location = LocationMeta(
+                        row.id,
+                        row.name,
+                        row.timezone,
+                        row.scan_goal,
+                        row.detailed_scan_goal,
+                        (),
+                    )
+                if row.dfs_vendor_location_id is not None:
+                    location = location._replace(
+                        dfs_vendor_location_ids=location.dfs_vendor_location_ids
+                        + (row.dfs_vendor_location_id,)
+                    )
+                loaded[row.id] = location
+            self._locations.update(loaded)
+        return {
+            location_id: self._locations[location_id]
+            for location_id in location_ids
+            if self._locations.get(location_id) is not None
+        }
+
+    def open_close(self, location_ids):
+        """get_open_close_dicts for the locations, computed once per set of locations
+
+        Returns:
+            tuple: (location open/close schedules, department open/close schedules)
+        """
+        key = frozenset(location_ids or ())
+        if key not in self._open_close:
+            self._open_close[key] = get_open_close_dicts(location_ids)
+        return self._open_close[key]
+
+
+_current_loader = ContextVar("location_metadata", default=None)
+
+
+def location_metadata():
+    """Loader of the current request, a new unshared loader outside of a request scope"""
+    return _current_loader.get() or LocationMetadataLoader()
+
+
+@contextmanager
+def location_metadata_scope():
+    """Share one LocationMetadataLoader with everything run inside the block"""
+    token = _current_loader.set(LocationMetadataLoader())
+    try:
+        yield _current_loader.get()
+    finally:
+        _current_loader.reset(token)
@@ -14,12 +14,24 @@ from backendlib.sessionmanager import get_session
 from datetime import datetime
 from chalicelib.services import PermissionService
 import uuid
-from datetime import datetime
-from sqlalchemy import or_
+from sqlalchemy import or_, insert, update, func, values, column
+from chalicelib.batching import batched
+from collections import Counter
+import csv
 import traceback
 
 user_schema = UserSchema()
 
+EMPLOYEE_UPLOAD_FIELDS = ("CODE", "FIRSTNAME", "LASTNAME")
+# Rows per multi-row INSERT, keeps bind parameters well under the postgres limit
+EMPLOYEE_INSERT_BATCH_SIZE = 1000
+# get_my_location_details flag -> location level permission it reflects
+LOCATION_PERMISSION_FLAGS = {
+    "allowLocationEdit": "edit_location",
+    "allowGoalsEdit": "set_goals",
+    "allowUploadEmployees": "upload_employees",
+}
+
 
 def get_loc_names(loc_ids):
     with get_session() as session:
@@ -37,175 +49,305 @@ def get_loc_names(loc_ids):
     return final
 
 
+def get_departments_by_location(session, location_ids):
+    """Departments of the given locations, queried on their own so callers do not
+    join them next to sensors or other per location children
+
+    Returns:
+        dict: location_id -> list of (department_id, department_name)
+    """
+    departments = {}
+    if not location_ids:
+        return departments
+    q = (
+        session.query(Department.location_id, Department.id, Department.name)
+        .filter(Department.location_id.in_(location_ids))
+        .order_by(Department.location_id, Department.id)
+    )
+    for location_id, department_id, department_name in q:
+        departments.setdefault(location_id, []).append((department_id, department_name))
+    return departments
+
+
+def parse_employee_csv(lines):
+    """Lazily turn CSV lines into bulk upload items
+
+    The header row is matched case insensitively against EMPLOYEE_UPLOAD_FIELDS, other
+    columns are ignored and blank lines skipped.
+
+    Args:
+        lines (iterable): text lines, e.g. a file object
+
+    Yields:
+        dict: {"CODE", "FIRSTNAME", "LASTNAME"} per employee row
+    """
+    reader = csv.reader(lines)
+    header = [h.strip().upper() for h in next(reader, [])]
+    missing = [f for f in EMPLOYEE_UPLOAD_FIELDS if f not in header]
+    if missing:
+        raise BadRequestError(f"Missing CSV columns: {', '.join(missing)}")
+    columns = [(f, header.index(f)) for f in EMPLOYEE_UPLOAD_FIELDS]
+    for row in reader:
+        if not any(v.strip() for v in row):
+            continue
+        yield {f: (row[i].strip() if i < len(row) else "") for f, i in columns}
+
+
 def bulk_upload_employees(loc_id, items_to_add):
-    now_timestamp = datetime.now()
-    with get_session() as session:
-        result = (
-            session.query(
-                Employee.employee_code, Employee.first_name, Employee.last_name
-            )
-            .filter(
-                Employee.location_id == loc_id,
-                Employee.employee_code != None,
-                Employee.active == True,
-            )
-            .all()
-        )
+    """Validate the whole upload up front and insert it with multi-row inserts
 
-        existing_emp_codes = (
-            [code for code, f_name, l_name in result] if len(result) > 0 else []
+    Args:
+        loc_id (int): location the employees belong to
+        items_to_add (iterable): {"CODE", "FIRSTNAME", "LASTNAME"} dicts, may be a generator
+
+    Returns:
+        tuple: (is_success, message), False when codes are already used at the location
+    """
+    items_to_add = list(items_to_add)
+    incomplete = [
+        str(i + 1)
+        for i, item in enumerate(items_to_add)
+        if any(not item.get(f) for f in EMPLOYEE_UPLOAD_FIELDS)
+    ]
+    if incomplete:
+        raise BadRequestError(
+            f"Missing CODE, FIRSTNAME or LASTNAME on rows: {', '.join(incomplete)}"
         )
-        emp_codes_to_add = [x["CODE"] for x in items_to_add]
-        already_existing_codes = list(
-            set(existing_emp_codes).intersection(set(emp_codes_to_add))
+    code_counts = Counter(item["CODE"] for item in items_to_add)
+    duplicate_codes = [code for code, count in code_counts.items() if count > 1]
+    if duplicate_codes:
+        raise BadRequestError(
+            f"Duplicate user codes: {', '.join(map(str, duplicate_codes))}"
         )
 
+    now_timestamp = datetime.now()
+    with get_session() as session:
+        already_existing_codes = []
+        for codes in batched(code_counts.keys(), EMPLOYEE_INSERT_BATCH_SIZE):
+            already_existing_codes += [
+                code
+                for code, in session.query(Employee.employee_code).filter(
+                    Employee.location_id == loc_id,
+                    Employee.employee_code.in_(codes),
+                    Employee.active == True,
+                )
+            ]
+
         if len(already_existing_codes) > 0:
             errorString = f"""Employees must have unique employee codes.\nThe following of the provided codes are already in use: {", ".join(already_existing_codes)}"""
             return False, errorString
-        inserted = set()
-        for item in items_to_add:
-            f_name = item["FIRSTNAME"]
-            l_name = item["LASTNAME"]
-            code = item["CODE"]
-            if code in inserted:
-                raise BadRequestError(f"Duplicate user codes: {code}")
-            generated_id = str(uuid.uuid4())
-            emp = Employee(
-                id=generated_id,
-                location_id=loc_id,
-                first_name=f_name,
-                last_name=l_name,
-                employee_code=code,
-                active=True,
-                registered_when=now_timestamp,
-                last_edited_when=now_timestamp,
+
+        for items in batched(items_to_add, EMPLOYEE_INSERT_BATCH_SIZE):
+            session.execute(
+                insert(Employee.__table__).values(
+                    [
+                        dict(
+                            id=str(uuid.uuid4()),
+                            location_id=loc_id,
+                            first_name=item["FIRSTNAME"],
+                            last_name=item["LASTNAME"],
+                            employee_code=item["CODE"],
+                            active=True,
+                            registered_when=now_timestamp,
+                            last_edited_when=now_timestamp,
+                        )
+                        for item in items
+                    ]
+                )
             )
-            session.add(emp)
-            inserted.add(code)
         session.commit()
 
     return True, "SUCCESS"
 
 
-def get_my_location_details(user_id, loc_id):
+def get_location_permission_flags(user_id, loc_id, known=None):
+    """Resolve the location settings page permission flags for a user
+
+    Args:
+        known (dict): already resolved flags, only the flags missing from it are looked up
+
+    Returns:
+        dict: allowLocationEdit, allowGoalsEdit, allowUploadEmployees
+    """
+    loc_id_int = int(loc_id)
+    flags = dict(known or {})
+    for flag, permission in LOCATION_PERMISSION_FLAGS.items():
+        if flag in flags:
+            continue
+        l_ids = PermissionService.get_l_ids_with_given_lgb_perms(user_id, [permission])
+        flags[flag] = loc_id_int in l_ids
+    return flags
+
+
+def get_my_location_details(user_id, loc_id, permissions=None):
+    """Location settings page details
+
+    Args:
+        permissions (dict): already resolved permission flags, any flag missing is
+            looked up, see get_location_permission_flags
+    """
+    flags = get_location_permission_flags(user_id, loc_id, known=permissions)
     with get_session() as session:
-        found_item = (
-            session.query(
-                Location.id,
-                Location.name,
-                Location.address,
-                Location.contact_name,
-                Location.email,
-                Location.phone_number,
-                Location.timezone,
-                WebappWeeklyGoals.goals,
-                Location.customer_id,
-            )
-            .filter(Location.id == loc_id)
-            .outerjoin(WebappWeeklyGoals)
-            .first()
-        )
+        return _load_location_details(session, loc_id, flags)
 
-        c_id = found_item[8]
-        if not found_item:
-            raise NotFoundError("No result found..")
 
-        loc_id_int = int(loc_id)
+def _load_location_details(session, loc_id, permissions):
+    """Load a location with its goals, departments/stations and forms in two queries
 
-        all_location_edit = PermissionService.get_l_ids_with_given_lgb_perms(
-            user_id, ["edit_location"]
-        )
-        all_goals_edit = PermissionService.get_l_ids_with_given_lgb_perms(
-            user_id, ["set_goals"]
+    Departments (with their stations) and the customer's active forms are JSON
+    aggregated inside the location query, the active compliance form is fetched
+    separately so it keeps its model representation.
+    """
+    loc_id_int = int(loc_id)
+    department_rows = (
+        session.query(
+            Department.id.label("departmentId"),
+            Department.name.label("departmentName"),
+            Department.contact_name.label("contactName"),
+            func.json_agg(
+                func.json_build_object(
+                    "stationId", Station.id, "stationName", Station.name
+                )
+            ).label("stations"),
         )
-        all_upload_employees = PermissionService.get_l_ids_with_given_lgb_perms(
-            user_id, ["upload_employees"]
+        .outerjoin(Station, Station.department_id == Department.id)
+        .filter(Department.location_id == loc_id_int)
+        .group_by(Department.id)
+        .subquery()
+    )
+    departments = session.query(
+        func.json_agg(
+            func.json_build_object(
+                "departmentId",
+                department_rows.c.departmentId,
+                "departmentName",
+                department_rows.c.departmentName,
+                "contactName",
+                department_rows.c.contactName,
+                "stations",
+                department_rows.c.stations,
+            )
         )
-
-        allow_location_edit = loc_id_int in all_location_edit
-        allow_goals_edit = loc_id_int in all_goals_edit
-        allow_upload_employees = loc_id_int in all_upload_employees
-
-        department_info = (
-            session.query(
-                Department.name.label("departmentName"),
-                Department.id.label("departmentId"),
-                Station.id.label("stationId"),
-                Station.name.label("stationName"),
-                Department.contact_name.label("contactName"),
+    ).label("departments")
+    possible_forms = (
+        session.query(
+            func.json_agg(
+                func.json_build_object(
+                    "id",
+                    Form.id,
+                    "form_type",
+                    Form.form_type,
+                    "title",
+                    Form.title,
+                    "owner_customer_id",
+                    Form.owner_customer_id,
+                )
             )
-            .outerjoin(Station, Station.department_id == Department.id)
-            .filter(Department.location_id == loc_id)
         )
-
-        form = (
-            session.query(ActiveForm)
-            .filter(ActiveForm.end_when == None, ActiveForm.location_id == loc_id_int)
-            .first()
+        .filter(
+            Form.active == True,
+            Form.owner_customer_id == Location.customer_id,
         )
+        .correlate(Location)
+        .label("possible_forms")
+    )
 
-        forms = session.query(
-            Form.id, Form.form_type, Form.title, Form.owner_customer_id
-        ).filter(
-            Form.active == True,
-            Form.owner_customer_id == c_id,
+    found_item = (
+        session.query(
+            Location.id,
+            Location.name,
+            Location.address,
+            Location.contact_name,
+            Location.email,
+            Location.phone_number,
+            Location.timezone,
+            WebappWeeklyGoals.goals,
+            Location.customer_id,
+            departments,
+            possible_forms,
         )
-        possible_forms = [dict(row) for row in forms]
-        department_dict = {}
-        for j in department_info:
-            d = dict(j)
-            d_info = department_dict.get(
-                d["departmentId"],
-                {
-                    "departmentId": d["departmentId"],
-                    "departmentName": d["departmentName"],
-                    "contactName": d["contactName"],
-                    "stations": [],
-                },
-            )
-            d_info["stations"].append(
-                {"stationId": d["stationId"], "stationName": d["stationName"]}
-            )
-            department_dict[d["departmentId"]] = d_info
-
-        mapped_result = {
-            "locationId": found_item[0],
-            "name": found_item[1],
-            "address": found_item[2],
-            "contactName": found_item[3],
-            "email": found_item[4],
-            "phoneNumber": found_item[5],
-            "timezone": found_item[6],
-            "hasGoals": (found_item[7] != None),
-            "customerId": c_id,
-            "allowLocationEdit": allow_location_edit,
-            "allowGoalsEdit": allow_goals_edit,
-            "allowUploadEmployees": allow_upload_employees,
-            "departmentDetails": list(department_dict.values()),
-            "complianceForm": form._as_dict() if form else None,
-            "possibleForms": possible_forms,
-        }
-        return mapped_result
+        .filter(Location.id == loc_id_int)
+        .outerjoin(WebappWeeklyGoals)
+        .first()
+    )
+    if not found_item:
+        raise NotFoundError("No result found..")
+
+    form = (
+        session.query(ActiveForm)
+        .filter(ActiveForm.end_when == None, ActiveForm.location_id == loc_id_int)
+        .first()
+    )
+
+    return {
+        "locationId": found_item.id,
+        "name": found_item.name,
+        "address": found_item.address,
+        "contactName": found_item.contact_name,
+        "email": found_item.email,
+        "phoneNumber": found_item.phone_number,
+        "timezone": found_item.timezone,
+        "hasGoals": (found_item.goals != None),
+        "customerId": found_item.customer_id,
+        "allowLocationEdit": permissions["allowLocationEdit"],
+        "allowGoalsEdit": permissions["allowGoalsEdit"],
+        "allowUploadEmployees": permissions["allowUploadEmployees"],
+        "departmentDetails": found_item.departments or [],
+        "complianceForm": form._as_dict() if form else None,
+        "possibleForms": found_item.possible_forms or [],
+    }
 
 
 def update_location(user_id, loc_id, update_schema, form_details):
     department_details = update_schema.pop("departmentDetails")
     compliance_form = form_details
+    # Callers have already checked edit_location before updating
+    flags = get_location_permission_flags(
+        user_id, loc_id, known={"allowLocationEdit": True}
+    )
     with get_session() as session:
         session.query(Location).filter(Location.id == loc_id).update(
             update_schema, synchronize_session="fetch"
         )
-        for d in department_details:
-            session.query(Department).filter(Department.id == d["departmentId"]).update(
-                {"name": d["departmentName"], "contact_name": d["contactName"]}
-            )
+        bulk_update_departments(session, loc_id, department_details or [])
         set_compliance_form(session, loc_id, compliance_form)
         session.commit()
-        return get_my_location_details(user_id, loc_id)
+        return _load_location_details(session, loc_id, flags)
+
+
+def bulk_update_departments(session, location_id, department_details):
+    """Rename departments of a location with a single UPDATE ... FROM (VALUES ...)
+
+    Does not commit. Departments that do not belong to location_id are left untouched.
+
+    Args:
+        department_details (list): {"departmentId", "departmentName", "contactName"} dicts
+    """
+    if not department_details:
+        return
+    changes = values(
+        column("id", Department.id.type),
+        column("name", Department.name.type),
+        column("contact_name", Department.contact_name.type),
+        name="department_changes",
+    ).data(
+        [
+            (d["departmentId"], d["departmentName"], d["contactName"])
+            for d in department_details
+        ]
+    )
+    session.execute(
+        update(Department.__table__)
+        .where(
+            Department.id == changes.c.id,
+            Department.location_id == location_id,
+        )
+        .values(name=changes.c.name, contact_name=changes.c.contact_name)
+    )
 
 
 def set_compliance_form(session, location_id, form_details):
+    """Does not commit, the caller owns the transaction"""
     current_form = session.query(ActiveForm).filter(
         ActiveForm.location_id == location_id, ActiveForm.end_when == None
     )
@@ -231,4 +373,3 @@ def set_compliance_form(session, location_id, form_details):
                 created_when=datetime.now(),
             )
         )
-    session.commit()
@@ -1,9 +1,68 @@
-from dialpad import DialpadClient
 from backendlib.secretsmanager import get_dialpad_token
+import os
 import re
 import logging
+import threading
 
-__DP_CLIENT = DialpadClient(token=get_dialpad_token())
+__DP_USER_ID = ""
+__DP_DEPARTMENT_ID = ""
+
+# Numbers per Dialpad send_sms call. Dialpad turns several to_numbers into one group
+# conversation where recipients see each other, so alerts default to one per call.
+SMS_BATCH_SIZE = int(os.environ.get("SMS_BATCH_SIZE", 1))
+# Set to "fake" to record messages locally instead of calling Dialpad
+SMS_TRANSPORT = os.environ.get("SMS_TRANSPORT", "dialpad")
+
+__DP_CLIENT = None
+__DP_CLIENT_LOCK = threading.Lock()
+
+
+class FakeDialpadClient(object):
+    """Stand in for DialpadClient that records sent messages, for tests and benchmarks
+
+    Usage:
+        client = FakeDialpadClient()
+        set_client(client)
+        send_sms(["5555555555"], "hello")
+        client.sms.sent -> [dict(user_id, to_numbers, text, ...)]
+    """
+
+    class _Sms(object):
+        def __init__(self, latency_seconds):
+            self.latency_seconds = latency_seconds
+            self.sent = []
+            self._lock = threading.Lock()
+
+        def send_sms(self, **kwargs):
+            if self.latency_seconds:
+                threading.Event().wait(self.latency_seconds)
+            with self._lock:
+                self.sent.append(kwargs)
+            return {"id": len(self.sent)}
+
+    def __init__(self, latency_seconds=0):
+        self.sms = FakeDialpadClient._Sms(latency_seconds)
+
+
+def get_client():
+    """Dialpad client, created on first use so importing this module makes no Secrets Manager call"""
+    global __DP_CLIENT
+    with __DP_CLIENT_LOCK:
+        if __DP_CLIENT is None:
+            if SMS_TRANSPORT == "fake":
+                __DP_CLIENT = FakeDialpadClient()
+            else:
+                from dialpad import DialpadClient
+
+                __DP_CLIENT = DialpadClient(token=get_dialpad_token())
+    return __DP_CLIENT
+
+
+def set_client(client):
+    """Replace the Dialpad client, e.g. with a FakeDialpadClient"""
+    global __DP_CLIENT
+    with __DP_CLIENT_LOCK:
+        __DP_CLIENT = client
 
 
 def to_e164(phone_number):
@@ -23,35 +82,48 @@ def to_e164(phone_number):
     return None
 
 
-def send_sms(phone_numbers, message):
+def send_sms(phone_numbers, message, batch_size=SMS_BATCH_SIZE):
     """_summary_
 
     Args:
         phone_numbers (list): List of E.164 formatted phone numbers. If a number is not of this format it
                               is assumed to be North America +1 number
         message (String):  the text message to send
+        batch_size (int): numbers sent per Dialpad request, see SMS_BATCH_SIZE
+
+    Returns:
+        int: number of phone numbers the message was sent to
     """
     if len(message) >= 1500:
         print(
             f"CANNOT SEND MESSAGE! {len(message)} exceeds the lenth of 1500 \n{message}"
         )
-        return
-    cleaned_numbers = [to_e164(phone) for phone in phone_numbers if to_e164(phone)]
+        return 0
+    # Format once and drop repeated numbers, keeping their order
+    cleaned_numbers = list(
+        dict.fromkeys(
+            number for number in map(to_e164, phone_numbers) if number is not None
+        )
+    )
     if not cleaned_numbers:
         print(f"No valid phone numbers for this Request -> {message}")
-        return
+        return 0
     print(f"Phone numbers: {cleaned_numbers}")
-    for number in cleaned_numbers:
-        if not number:
-            continue
+    client = get_client()
+    batch_size = max(1, batch_size)
+    sent = 0
+    for i in range(0, len(cleaned_numbers), batch_size):
+        numbers = cleaned_numbers[i : i + batch_size]
         try:
-            response_code = __DP_CLIENT.sms.send_sms(
+            response_code = client.sms.send_sms(
                 user_id=__DP_USER_ID,
-                to_numbers=[number],
+                to_numbers=numbers,
                 text=message,
                 sender_group_id=__DP_DEPARTMENT_ID,
                 sender_group_type="department",
             )
             logging.info(f" response {response_code}")
+            sent += len(numbers)
         except Exception as e:
-            print(f"Failed to properly handle number {number} - {e}")
+            print(f"Failed to properly handle numbers {numbers} - {e}")
+    return sent
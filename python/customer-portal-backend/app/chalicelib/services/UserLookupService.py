@@ -0,0 +1,59 @@
+from backendlib.models import WebappUser
+
+# SensorAction columns holding lists of WebappUser ids
+SENSOR_ACTION_USER_FIELDS = ("to", "cc", "bcc", "phone_to")
+
+
+def sensor_action_user_ids(sensor_action):
+    """Collect every user id referenced by a SensorAction's recipient lists
+
+    Args:
+        sensor_action (SensorAction): action row, None is allowed for outer joins
+
+    Returns:
+        set: referenced user ids
+    """
+    user_ids = set()
+    if sensor_action is None:
+        return user_ids
+    for field in SENSOR_ACTION_USER_FIELDS:
+        user_ids.update(getattr(sensor_action, field, None) or [])
+    return user_ids
+
+
+class UserLookupService(object):
+    """Request scoped WebappUser resolver.
+
+    Only the requested ids are fetched, in a single IN query per call, and every
+    resolved user is kept for the lifetime of the instance so repeated ids never
+    go back to the database. Create one per request/session.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._users = {}
+
+    def resolve(self, user_ids):
+        """Fetch any of the given user ids that are not cached yet
+
+        Args:
+            user_ids (iterable): WebappUser ids
+
+        Returns:
+            dict: user_id -> row(id, first_name, last_name, email, phone_number) for every user resolved so far
+        """
+        missing = {u_id for u_id in user_ids if u_id is not None} - self._users.keys()
+        if missing:
+            q = self.session.query(
+                WebappUser.id,
+                WebappUser.first_name,
+                WebappUser.last_name,
+                WebappUser.email,
+                WebappUser.phone_number,
+            ).filter(WebappUser.id.in_(missing))
+            for row in q:
+                self._users[row.id] = row
+        return self._users
+
+    def get(self, user_id):
+        return self._users.get(user_id)
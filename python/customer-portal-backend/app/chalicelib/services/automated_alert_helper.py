@@ -1,11 +1,15 @@
-from backendlib.services.EmailService import EmailService, EMAIL_SRC
-from chalicelib.services.SMSService import send_sms
+from backendlib.services.EmailService import EMAIL_SRC
+from chalicelib.services.AlertQueue import coalesced_alerts
 from backendlib.models import AutomatedReport, ReportTemplate, WebappUser
 from backendlib.utils import REVERSE_TEMPLATE_MAPPER
 import logging
 
 
 def send_alert(session, payload, template_class, location_id):
+    if EMAIL_SRC != "PROD":
+        logging.info(f" {EMAIL_SRC} SKIPPING SENDING {template_class}")
+        return
+
     reports = (
         session.query(AutomatedReport, ReportTemplate)
         .join(ReportTemplate, ReportTemplate.id == AutomatedReport.report_template_id)
@@ -16,46 +20,56 @@ def send_alert(session, payload, template_class, location_id):
                 REVERSE_TEMPLATE_MAPPER[template_class]
             ),
         )
+        .all()
     )
-    for report, template in reports:
-        if EMAIL_SRC != "PROD":
-            logging.info(f" {EMAIL_SRC} SKIPPING SENDING {template_class}")
-            return
-
-        phone_to = report.phone_to or []
-        email_to = report.to or []
-        email_cc = report.cc or []
-        email_bcc = report.bcc or []
-        users = set(phone_to + email_to + email_cc + email_bcc)
-
-        if not users:
-            logging.info(f" {EMAIL_SRC} No users set to receive alerts")
-            return
 
-        users_data = session.query(WebappUser).filter(
-            WebappUser.id.in_(users), WebappUser.active.is_(True)
+    # Resolve the recipients of every report in one query
+    all_users = set()
+    for report, _ in reports:
+        all_users.update(
+            (report.phone_to or [])
+            + (report.to or [])
+            + (report.cc or [])
+            + (report.bcc or [])
         )
+    if not all_users:
+        logging.info(f" {EMAIL_SRC} No users set to receive alerts")
+        return
+    users_data = {
+        user.id: user
+        for user in session.query(
+            WebappUser.id, WebappUser.phone_number, WebappUser.email
+        ).filter(WebappUser.id.in_(all_users), WebappUser.active.is_(True))
+    }
 
-        if "sms" in template.delivery_method:
-            phone_numbers = [
-                user.phone_number for user in users_data if user.id in phone_to
-            ]
-            if phone_numbers:
-                send_sms(
-                    phone_numbers=phone_numbers,
-                    message=template.sms_string.format(**payload),
-                )
-        if report.to and "email" in template.delivery_method:
-            to_emails = [user.email for user in users_data if user.id in email_to]
-            cc_emails = [user.email for user in users_data if user.id in email_cc]
-            bcc_emails = [user.email for user in users_data if user.id in email_bcc]
+    def recipients(user_ids, field):
+        return [
+            getattr(users_data[u_id], field)
+            for u_id in dict.fromkeys(user_ids or [])
+            if u_id in users_data
+        ]
 
-            if to_emails:
-                EmailService.send_template_based_email(
-                    template_id=template.send_grid_id,
-                    from_email="cs@null.com",
-                    to_emails=to_emails,
-                    cc_emails=cc_emails,
-                    bcc_emails=bcc_emails,
-                    category=f"alert-{template_class}",
-                )
+    # Delivered when the invocation's coalesced_alerts() block exits, or when this
+    # call is the outermost block
+    with coalesced_alerts() as queue:
+        for report, template in reports:
+            if "sms" in template.delivery_method:
+                phone_numbers = recipients(report.phone_to, "phone_number")
+                if phone_numbers:
+                    queue.add_sms(
+                        phone_numbers=phone_numbers,
+                        message=template.sms_string.format(**payload),
+                    )
+            if report.to and "email" in template.delivery_method:
+                to_emails = recipients(report.to, "email")
+                if to_emails:
+                    queue.add_email(
+                        template_id=template.send_grid_id,
+                        from_email="cs@null.com",
+                        to_emails=to_emails,
+                        cc_emails=recipients(report.cc, "email"),
+                        bcc_emails=recipients(report.bcc, "email"),
+                        category=f"alert-{template_class}",
+                    )
+        if queue.due():
+            queue.flush()
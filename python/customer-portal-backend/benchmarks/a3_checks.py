@@ -0,0 +1,249 @@
+"""Time the A3 check evaluation for one location-day of 5 minute sensor readings
+
+Builds the in memory readings a single __get_report_readings fetch returns for a
+location and runs every check window through __assign_readings_to_check and
+__get_check, the same loop as __get_readings_for_dates without the database.
+
+The baseline is the per check evaluation the report used before: each check's
+window rows, which the database used to return with one query per check, walked
+reading by reading with the strftime / strptime eligibility test. The window rows
+are built before timing, as the database did that part. Both paths run on the same
+readings and their check readings are compared.
+
+Run from python/customer-portal-backend with the app requirements installed:
+
+    python benchmarks/a3_checks.py --sensors 40 --checks 6
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from chalicelib.routes import reporting  # noqa: E402
+
+READING_INTERVAL = datetime.timedelta(minutes=5)
+UNIT_TYPES = ("Fridge", "Walk-in Freezer", "Walk-in Fridge", "Ambient")
+
+__get_check_windows = getattr(reporting, "__get_check_windows")
+__get_sensor_limits = getattr(reporting, "__get_sensor_limits")
+__assign_readings_to_check = getattr(reporting, "__assign_readings_to_check")
+__get_check = getattr(reporting, "__get_check")
+TIME_FORMAT = reporting.TIME_Q_STR_FORMAT
+
+
+def location_day(request_date, n_sensors, seed=0):
+    """Readings of one location-day in the shape __get_report_readings returns
+
+    Sensors drift in and out of range so checks exercise both the out of range
+    interval and the in range paths.
+    """
+    rnd = random.Random(seed)
+    day_start = datetime.datetime.strptime(request_date, "%Y-%m-%d")
+    sensors = {}
+    for sensor_id in range(n_sensors):
+        row = dict(
+            sensor_name=f"Sensor {sensor_id}",
+            category=[],
+            department_id=1,
+            location_id=1,
+            active=True,
+            sensor_id=sensor_id,
+            unit_type=UNIT_TYPES[sensor_id % len(UNIT_TYPES)],
+        )
+        readings = []
+        hot = False
+        when = day_start
+        while when < day_start + datetime.timedelta(days=1):
+            if rnd.random() < 0.02:
+                hot = not hot
+            readings.append(
+                dict(
+                    row,
+                    sensor_reading=rnd.uniform(6, 12) if hot else rnd.uniform(-20, 4),
+                    sensor_unit="C",
+                    created_when=when,
+                    local_created_when=when.replace(tzinfo=datetime.timezone.utc),
+                    reading_id=len(readings),
+                )
+            )
+            when += READING_INTERVAL
+        sensors[sensor_id] = dict(
+            sensor=dict(
+                row,
+                sensor_reading=None,
+                sensor_unit=None,
+                created_when=None,
+                local_created_when=None,
+                reading_id=None,
+            ),
+            readings=readings,
+            times=[reading["created_when"] for reading in readings],
+        )
+    return sensors
+
+
+def evaluate_checks(sensors, windows):
+    sensor_limits = __get_sensor_limits(sensors)
+    readings = []
+    for i, window in enumerate(windows):
+        readings += [
+            dict(reading, sensor_check_id=i)
+            for reading in __get_check(
+                by_sensor=__assign_readings_to_check(sensors, window),
+                sensor_limits=sensor_limits,
+                check_start_nominal=window["start_nominal"],
+            )
+        ]
+    return readings
+
+
+def baseline_check_rows(sensors, window):
+    """Rows the old per check query returned, ordered by sensor and reading time"""
+    rows = []
+    for sensor_id in sorted(sensors):
+        sensor = sensors[sensor_id]
+        in_window = [
+            dict(reading, out_of_range=False)
+            for reading, when in zip(sensor["readings"], sensor["times"])
+            if window["start"] <= when <= window["end"]
+        ]
+        rows += in_window or [dict(sensor["sensor"], out_of_range=False)]
+    return rows
+
+
+def baseline_eligible(reading, check_start):
+    if reading["local_created_when"] is None:
+        return False
+    offset_naive = datetime.datetime.strptime(
+        datetime.datetime.strftime(reading["local_created_when"], TIME_FORMAT),
+        TIME_FORMAT,
+    )
+    return offset_naive >= check_start
+
+
+def baseline_pick(in_range, out_of_range, check_start):
+    if in_range is not None and baseline_eligible(in_range, check_start):
+        return in_range
+    if out_of_range is not None and baseline_eligible(out_of_range, check_start):
+        return out_of_range
+    return None
+
+
+def baseline_get_check(rows, check_start_nominal):
+    """The per check loop of __get_check before the A3 rework"""
+    by_sensor = {}
+    for row in rows:
+        by_sensor.setdefault(row["sensor_id"], []).append(row)
+
+    ret = {}
+    for sensor_id, check_readings in by_sensor.items():
+        oor_start = None
+        oor_interval_found = False
+        last_oor_interval_reading = None
+        last_ir_reading = None
+        last_oor_reading = None
+        for check_reading in check_readings:
+            limits = reporting.check_unit_type_has_limits(check_reading["unit_type"])
+            if limits.get("high") is None:
+                ret[sensor_id] = check_reading
+                continue
+            current_reading = check_reading["sensor_reading"]
+            if current_reading is not None and current_reading > limits["high"]:
+                last_oor_reading = check_reading
+                if oor_start is None:
+                    oor_start = last_oor_reading["local_created_when"]
+                oor_interval = last_oor_reading["local_created_when"] - oor_start
+                if oor_interval >= reporting.OOR_INTERVAL:
+                    oor_interval_found = True
+                    last_oor_interval_reading = last_oor_reading
+            else:
+                oor_start = None
+                last_ir_reading = check_reading
+
+            non_alert_reading_to_use = baseline_pick(
+                last_ir_reading, last_oor_reading, check_start_nominal
+            )
+            if oor_interval_found and last_oor_interval_reading:
+                if baseline_eligible(last_oor_interval_reading, check_start_nominal):
+                    last_oor_interval_reading["out_of_range"] = True
+                    ret[sensor_id] = last_oor_interval_reading
+                elif non_alert_reading_to_use is not None:
+                    ret[sensor_id] = non_alert_reading_to_use
+            elif non_alert_reading_to_use is not None:
+                ret[sensor_id] = non_alert_reading_to_use
+            else:
+                ret[sensor_id] = check_reading
+    return ret.values()
+
+
+def baseline_evaluate_checks(rows_by_window, windows):
+    readings = []
+    for i, (rows, window) in enumerate(zip(rows_by_window, windows)):
+        readings += [
+            dict(reading, sensor_check_id=i)
+            for reading in baseline_get_check(rows, window["start_nominal"])
+        ]
+    return readings
+
+
+def selected(readings):
+    return sorted(
+        (r["sensor_check_id"], r["sensor_id"], r["reading_id"] or -1) for r in readings
+    )
+
+
+def best_ms(evaluate, readings, windows, args):
+    timings = timeit.repeat(
+        lambda: evaluate(readings, windows),
+        repeat=args.repeat,
+        number=args.number,
+    )
+    return min(timings) / args.number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sensors", type=int, default=40)
+    parser.add_argument("--checks", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=10)
+    args = parser.parse_args()
+
+    request_date = "2024-03-05"
+    hours = 24 // args.checks
+    checks = [
+        dict(
+            start_time=f"{i * hours:02d}:00:00",
+            end_time=f"{(i + 1) * hours - 1:02d}:59:59",
+        )
+        for i in range(args.checks)
+    ]
+    windows = __get_check_windows(request_date, checks)
+    sensors = location_day(request_date, args.sensors)
+
+    n_readings = sum(len(sensor["readings"]) for sensor in sensors.values())
+    rows_by_window = [baseline_check_rows(sensors, window) for window in windows]
+    check_readings = evaluate_checks(sensors, windows)
+    same = selected(check_readings) == selected(
+        baseline_evaluate_checks(rows_by_window, windows)
+    )
+    baseline = best_ms(baseline_evaluate_checks, rows_by_window, windows, args)
+    current = best_ms(evaluate_checks, sensors, windows, args)
+    print(
+        f"{args.sensors} sensors, {n_readings} readings, {len(windows)} checks "
+        f"-> {len(check_readings)} check readings, same as baseline: {same}"
+    )
+    print(f"baseline per check: best {baseline:.2f} ms per location-day")
+    print(
+        f"current: best {current:.2f} ms per location-day, "
+        f"{baseline / current:.1f}x faster"
+    )
+
+
+if __name__ == "__main__":
+    main()
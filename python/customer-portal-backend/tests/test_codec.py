@@ -0,0 +1,34 @@
+import datetime
+import json
+from decimal import Decimal
+
+import pytest
+
+from chalicelib import codec
+
+ROW = {
+    "created_when": datetime.datetime(2024, 1, 31, 10, 0, tzinfo=datetime.timezone.utc),
+    "local_created_when": datetime.datetime(2024, 1, 31, 10, 0, 30, 500),
+    "date": datetime.date(2024, 1, 31),
+    "reading": Decimal("3.50"),
+}
+# What json.dumps(default=str) wrote before orjson
+EXPECTED = {
+    "created_when": "2024-01-31 10:00:00+00:00",
+    "local_created_when": "2024-01-31 10:00:30.000500",
+    "date": "2024-01-31",
+    "reading": "3.50",
+}
+
+
+@pytest.mark.parametrize("dumps", [codec._json_dumps, codec._orjson_dumps])
+def test_datetimes_keep_str_format(dumps):
+    if dumps is codec._orjson_dumps and codec.orjson is None:
+        pytest.skip("orjson is not installed")
+    assert json.loads(dumps(ROW)) == EXPECTED
+
+
+def test_json_zip_matches_default_str():
+    assert codec.json_zip(ROW) == codec.b64zip(
+        json.dumps(ROW, default=str, separators=(",", ":"))
+    )
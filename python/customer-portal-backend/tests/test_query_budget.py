@@ -0,0 +1,77 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from chalicelib import instrumentation
+from chalicelib.instrumentation import (
+    QueryBudgetExceeded,
+    instrument_request,
+    query_budget,
+)
+
+
+@pytest.fixture
+def engine():
+    return create_engine("sqlite://")
+
+
+@pytest.fixture(autouse=True)
+def strict_budgets(monkeypatch):
+    monkeypatch.setattr(instrumentation, "QUERY_BUDGET_STRICT", True)
+
+
+def run_queries(engine, n):
+    with engine.connect() as conn:
+        for i in range(n):
+            conn.execute(text("SELECT :i"), {"i": i})
+
+
+def test_budget_exceeded_raises(engine):
+    with pytest.raises(QueryBudgetExceeded) as exc_info:
+        with query_budget(2, "handler"):
+            run_queries(engine, 3)
+    message = str(exc_info.value)
+    assert "handler ran 3 queries, budget is 2" in message
+    # The repeated statement is listed with its count
+    assert "3x SELECT ?" in message
+
+
+def test_budget_decorator(engine):
+    @query_budget(1)
+    def handler():
+        run_queries(engine, 2)
+
+    with pytest.raises(QueryBudgetExceeded):
+        handler()
+
+
+def test_within_budget(engine):
+    with query_budget(3) as stats:
+        run_queries(engine, 3)
+    assert stats.query_count == 3
+
+
+def test_only_block_queries_count(engine):
+    with instrument_request("GET /route") as stats:
+        run_queries(engine, 5)
+        with query_budget(2):
+            run_queries(engine, 2)
+    assert stats.query_count == 7
+
+
+def test_track_queries_restored(engine):
+    with instrument_request("GET /route") as stats:
+        with query_budget(5):
+            assert stats.track_queries
+        assert not stats.track_queries
+
+
+def test_failed_statement_leaves_no_state(engine):
+    with instrument_request("GET /route") as stats:
+        with engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+            conn.execute(text("SELECT 1"))
+            leftover = dict(conn.info)
+    assert stats.query_count == 1
+    assert leftover == {}
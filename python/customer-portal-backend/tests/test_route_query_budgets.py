@@ -0,0 +1,85 @@
+import contextlib
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from chalicelib import instrumentation
+from chalicelib.instrumentation import QueryBudgetExceeded
+from chalicelib.routes import reporting
+
+CHECKS = [
+    dict(start_time="06:00:00", end_time="09:59:59"),
+    dict(start_time="12:00:00", end_time="17:59:59"),
+]
+
+
+@pytest.fixture(autouse=True)
+def strict_budgets(monkeypatch):
+    monkeypatch.setattr(instrumentation, "QUERY_BUDGET_STRICT", True)
+
+
+@pytest.fixture
+def bulk_report(monkeypatch):
+    """get_report_days with each database helper replaced by a single SQLite query
+
+    The handler's query count is then the number of helper calls it makes, so a
+    helper called per day or per section shows up against its budget.
+    """
+    engine = create_engine("sqlite://")
+
+    def one_query(result):
+        def helper(*args, **kwargs):
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return result
+
+        return helper
+
+    monkeypatch.setattr(reporting, "report_list_helper", one_query({1: {}}))
+    monkeypatch.setattr(
+        reporting, "get_approved_permissions_per_level", one_query([1, 2, 3])
+    )
+    monkeypatch.setattr(reporting, "get_authorized_user_id", lambda request: 1)
+    monkeypatch.setattr(reporting, "decamelize", lambda params: params)
+    monkeypatch.setattr(reporting, "get_session", contextlib.nullcontext)
+    monkeypatch.setitem(
+        vars(reporting),
+        "__get_report_filters",
+        one_query((dict(checks=CHECKS), [])),
+    )
+    monkeypatch.setitem(vars(reporting), "__get_report_readings", one_query({}))
+    monkeypatch.setitem(vars(reporting), "__get_approval_logs", one_query([]))
+
+    def get_report_days(**query_params):
+        monkeypatch.setattr(
+            reporting,
+            "bp_reporting",
+            SimpleNamespace(current_request=SimpleNamespace(query_params=query_params)),
+        )
+        return reporting.get_report_days()
+
+    return get_report_days
+
+
+def test_report_days_within_budget(bulk_report):
+    # The longest range, for a location and every department
+    bulk_report(
+        report_id="1",
+        location_id="1",
+        department_ids="1,2,3",
+        start_date="2024-03-01",
+        end_date="2024-03-31",
+    )
+
+
+def test_report_days_per_day_fetch_exceeds_budget(bulk_report, monkeypatch):
+    # One readings fetch per day is the N+1 the chunked fetch replaced
+    monkeypatch.setattr(reporting, "REPORT_READINGS_CHUNK_DAYS", 1)
+    with pytest.raises(QueryBudgetExceeded):
+        bulk_report(
+            report_id="1",
+            location_id="1",
+            start_date="2024-03-01",
+            end_date="2024-03-31",
+        )
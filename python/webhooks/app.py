@@ -22,7 +22,11 @@ from backendlib.sessionmanager import (
 from chalicelib.routes.the_things_network import bp_ttn
 from aws_lambda_powertools.metrics import MetricUnit
 from chalicelib.utils.powertools import metrics, logger, tracer
-from chalicelib.utils.runtime_tools import get_runtime_config_param_value, __IS_PROD
+from chalicelib.utils.runtime_tools import (
+    get_runtime_config_param_value,
+    refresh_runtime_config_if_stale,
+    __IS_PROD,
+)
 
 
 env = os.environ.get("EMAIL_SRC", "Unknown")
@@ -89,6 +93,16 @@ def initialize_user_session(event, get_response):
         raise ie
 
 
+@app.middleware("all")
+def refresh_runtime_config_after_invocation(event, get_response):
+    try:
+        return get_response(event)
+    finally:
+        # The handler's work is done, a stale runtime config is refreshed here
+        # instead of on the path of the next message
+        refresh_runtime_config_if_stale()
+
+
 # routes #####
 # health check endpoint to see if API is working
 @app.route("/")
@@ -1,10 +1,13 @@
 import boto3
+from botocore.config import Config
 import json
+import threading
 import time
 import os
+import urllib.request
 from chalicelib.types.config_models import RuntimeConfigParameter, RuntimeConfig
 from chalicelib.utils.powertools import logger
-from typing import Literal, Optional
+from typing import Literal, NamedTuple, Optional
 
 __IS_PROD = os.getenv("CHALICE_STAGE", "staging") == "prod"
 
@@ -19,6 +22,50 @@ rt_stage = os.getenv("CHALICE_STAGE", "staging")
 # Basic in-memory cache
 _json_config_cache = {}
 
+# Seconds before the runtime config snapshot is refreshed
+RUNTIME_CONFIG_TTL = int(os.getenv("RUNTIME_CONFIG_TTL", 60))
+# Seconds a fetch may wait on the config source
+RUNTIME_CONFIG_FETCH_TIMEOUT = float(os.getenv("RUNTIME_CONFIG_FETCH_TIMEOUT", 1))
+# "ssm" reads the runtime parameter from Parameter Store, "appconfig" reads it from the
+# AWS AppConfig Lambda extension's local endpoint
+RUNTIME_CONFIG_SOURCE = os.getenv("RUNTIME_CONFIG_SOURCE", "ssm")
+APPCONFIG_EXTENSION_URL = "http://localhost:{port}/applications/{app}/environments/{env}/configurations/{profile}".format(
+    port=os.getenv("AWS_APPCONFIG_EXTENSION_HTTP_PORT", "2772"),
+    app=os.getenv("RUNTIME_CONFIG_APPCONFIG_APPLICATION", rt_app_name),
+    env=os.getenv("RUNTIME_CONFIG_APPCONFIG_ENVIRONMENT", rt_stage),
+    profile=os.getenv("RUNTIME_CONFIG_APPCONFIG_PROFILE", "runtime"),
+)
+
+
+class RuntimeConfigSnapshot(NamedTuple):
+    """Validated runtime configuration, replaced as a whole on every refresh"""
+
+    config: RuntimeConfig
+    fetched_at: float
+
+    def is_stale(self, ttl: int = RUNTIME_CONFIG_TTL) -> bool:
+        return time.time() - self.fetched_at >= ttl
+
+
+_runtime_config_snapshot: Optional[RuntimeConfigSnapshot] = None
+_runtime_config_refresh_lock = threading.Lock()
+_runtime_config_ssm = None
+
+
+def _runtime_config_client():
+    """Separate SSM client so runtime config reads fail fast instead of retrying, created on first use"""
+    global _runtime_config_ssm
+    if _runtime_config_ssm is None:
+        _runtime_config_ssm = boto3.client(
+            "ssm",
+            config=Config(
+                connect_timeout=RUNTIME_CONFIG_FETCH_TIMEOUT,
+                read_timeout=RUNTIME_CONFIG_FETCH_TIMEOUT,
+                retries={"max_attempts": 1},
+            ),
+        )
+    return _runtime_config_ssm
+
 
 def get_env_ssm_config(
     param_name: str, ttl: int = 60, fallback: Optional[dict] = None
@@ -59,35 +106,124 @@ def get_env_ssm_config(
     return fallback or {}
 
 
+def _fetch_runtime_config_dict() -> Optional[dict]:
+    """
+    Read the runtime configuration JSON from its source.
+
+    Returns:
+        dict | None: Parsed configuration, None when it could not be read.
+    """
+    if RUNTIME_CONFIG_SOURCE == "appconfig":
+        try:
+            with urllib.request.urlopen(
+                APPCONFIG_EXTENSION_URL, timeout=RUNTIME_CONFIG_FETCH_TIMEOUT
+            ) as response:
+                return json.loads(response.read())
+        except Exception as e:
+            logger.exception(
+                f"Unable to read runtime config from AppConfig '{APPCONFIG_EXTENSION_URL}': {e}"
+            )
+            return None
+
+    param_name = f"/{rt_app_name}/{rt_stage}/config/runtime"
+    client = _runtime_config_client()
+    try:
+        param = client.get_parameter(Name=param_name, WithDecryption=False)
+        return json.loads(param["Parameter"]["Value"])
+    except client.exceptions.ParameterNotFound:
+        logger.warning(f"SSM parameter '{param_name}' not found. Using defaults.")
+        return {}
+    except json.JSONDecodeError:
+        logger.error(f"SSM parameter '{param_name}' is not valid JSON.")
+    except Exception as e:
+        logger.exception(f"Unexpected error reading SSM parameter '{param_name}': {e}")
+    return None
+
+
+def refresh_runtime_config() -> RuntimeConfigSnapshot:
+    """
+    Fetch and validate the runtime configuration and publish it as the current snapshot.
+
+    When the source cannot be read or does not validate, the previous configuration
+    (or the defaults) is kept and retried after RUNTIME_CONFIG_TTL.
+
+    Returns:
+        RuntimeConfigSnapshot: The snapshot now in use.
+    """
+    global _runtime_config_snapshot
+    previous = _runtime_config_snapshot
+    config = previous.config if previous else RuntimeConfig()
+    runtime_config_dict = _fetch_runtime_config_dict()
+    if runtime_config_dict is not None:
+        try:
+            config = RuntimeConfig(**runtime_config_dict)
+        except Exception as e:
+            logger.error(f"Invalid runtime config, keeping the previous values: {e}")
+    # Readers never lock, they see either the old or the new snapshot
+    _runtime_config_snapshot = RuntimeConfigSnapshot(
+        config=config, fetched_at=time.time()
+    )
+    return _runtime_config_snapshot
+
+
+def get_runtime_config() -> RuntimeConfig:
+    """
+    Current runtime configuration snapshot, served as is even when stale.
+
+    A stale snapshot is refreshed by refresh_runtime_config_if_stale once the
+    invocation's handler has finished, never by a reader. Only the first read in a
+    container (cold start) loads the configuration, waiting at most
+    RUNTIME_CONFIG_FETCH_TIMEOUT on the source.
+
+    Returns:
+        RuntimeConfig: Validated runtime configuration.
+    """
+    snapshot = _runtime_config_snapshot
+    if snapshot is None:
+        with _runtime_config_refresh_lock:
+            snapshot = _runtime_config_snapshot or refresh_runtime_config()
+    return snapshot.config
+
+
+def refresh_runtime_config_if_stale() -> None:
+    """
+    Refresh the snapshot when it is older than RUNTIME_CONFIG_TTL, never raises.
+
+    Called after the handler of an invocation returns, Lambda freezes the container
+    between invocations so there is no background thread to do it. Nothing happens
+    before the first read has loaded a snapshot or while another refresh runs.
+    """
+    snapshot = _runtime_config_snapshot
+    if snapshot is None or not snapshot.is_stale():
+        return
+    if not _runtime_config_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        refresh_runtime_config()
+    except Exception as e:
+        logger.exception(f"Runtime config refresh failed: {e}")
+    finally:
+        _runtime_config_refresh_lock.release()
+
+
 def get_runtime_config_param_value(
     param_key: RuntimeConfigParameter, fallback: Optional[ParamType] = None
 ):
     """
-    Fetch runtime configuration JSON SSM Parameter Store and retrieve configuration attribute value
+    Retrieve a runtime configuration attribute value from the current snapshot
 
     Args:
         param_key (RuntimeConfigParameter): Configuration key for desired attribute value.
         fallback (ParamType | None): Optional fallback value if parameter is missing or invalid.
 
     Returns:
-        ParamType: Parsed value from SSM (or fallback).
+        ParamType: Configured value (or fallback).
     """
-    config_type = "runtime"
-    param_name = f"/{rt_app_name}/{rt_stage}/config/{config_type}"
-    runtime_config_dict = get_env_ssm_config(param_name)
-    default_runtime_config = RuntimeConfig()
-    if param_key in runtime_config_dict and hasattr(default_runtime_config, param_key):
-        runtime_config = RuntimeConfig(**runtime_config_dict)
-    else:
-        runtime_config = default_runtime_config
-    try:
-        param = getattr(runtime_config, param_key, None)
-        if param is None:
-            raise AttributeError()
-        return param
-    except AttributeError:
-        param_name = f"/{os.getenv('CHALICE_APP_NAME', '')}/{os.getenv('CHALICE_STAGE')}/config/runtime"
+    param = getattr(get_runtime_config(), param_key, None)
+    if param is None:
+        param_name = f"/{rt_app_name}/{rt_stage}/config/runtime"
         logger.error(
-            f"SSM parameter '{param_name}' does not contain attribute '{param_key}' Using fallback."
+            f"Runtime config '{param_name}' does not contain attribute '{param_key}' Using fallback."
         )
         return fallback
+    return param